@@ -0,0 +1,69 @@
+"""classify against the sequential detect_type + set_notes searches it replaced.
+
+Runs both over the recorded outcomes in tests/data/outcomes.txt, checks they agree on every
+type and match, then times them.
+
+    python benchmarks/bench_classify.py [--repeat 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'wikiscripts'))
+import events  # noqa: E402
+
+OUTCOMES_FILE = os.path.join(ROOT, 'tests', 'data', 'outcomes.txt')
+
+
+# the old detect_type: every regex in order until one matches
+def detect_type(outcome):
+    for outcome_type, pattern in events.outcomes_dict.items():
+        if pattern.search(outcome):
+            return outcome_type
+    return 'Unknown'
+
+
+# detect_type, then the two searches set_notes used to make for the match
+def classify_old(outcome):
+    outcome_type = detect_type(outcome)
+    if outcome_type == 'Unknown':
+        return outcome_type, None
+    if events.outcomes_dict[outcome_type].search(outcome) is None:
+        return outcome_type, None
+    return outcome_type, events.outcomes_dict[outcome_type].search(outcome)
+
+
+def describe(classified):
+    outcome_type, re_match = classified
+    return outcome_type, (re_match.span(), re_match.groupdict()) if re_match else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    with open(OUTCOMES_FILE, encoding='utf-8') as f:
+        outcomes = [line.rstrip('\n') for line in f if line.strip()]
+    different = [outcome for outcome in outcomes if describe(events.classify(outcome)) != describe(classify_old(outcome))]
+    print(f'{len(outcomes)} outcomes, {len(different)} classified differently')
+    for outcome in different:
+        print(f'    {outcome}')
+
+    corpus = outcomes * args.repeat
+    timings = {}
+    for name, func in [('detect_type + set_notes', classify_old), ('classify', events.classify)]:
+        start = time.perf_counter()
+        for outcome in corpus:
+            func(outcome)
+        timings[name] = time.perf_counter() - start
+        print(f'{name}: {timings[name] * 1000:.0f} ms for {len(corpus)} outcomes '
+              f'({len(corpus) / timings[name]:,.0f}/s)')
+    print(f'{timings["detect_type + set_notes"] / timings["classify"]:.1f}x faster')
+    return 1 if different else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
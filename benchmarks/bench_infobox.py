@@ -0,0 +1,116 @@
+"""patch_infobox against the full wikitextparser parse it replaces.
+
+First checks that both give the same page for a few hundred generated player pages (comments,
+nested templates, piped links, <ref> and <math> pipes, missing arguments, unclosed infoboxes),
+then times them on pages with long community lore.
+
+    python benchmarks/bench_infobox.py [--pages 300] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import wikitextparser as wtp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wikiscripts'))
+import infobox  # noqa: E402
+
+SKELETON = """{{{{Template:New_Player_Header}}}} <!-- note -->
+{{{{Player
+| title1={{{{{{{{{{{{PAGENAME}}}}}}}}}}}}
+<!-- Use the filename with the file type -->
+| image1=
+| aliases= <!-- IN GAME NAMES ONLY -->
+| team=[[Boston Flowers|Flowers]]
+| batting={{{{Star Rating|{batting}}}}}
+| pitching= {{{{Star Rating|0.5}}}}
+| baserunning={{{{Star Rating| 4 }}}}
+{extra}| defense={{{{Star Rating|2.5}}}} <!-- x = y -->
+| item=
+| armor=Cape
+| ritual={ritual}
+| coffee={{{{{{coffee|Black}}}}}}
+| blood={blood}
+| fate=12
+| soulscream=AAAH
+{uuid}}}}}
+"""
+LORE = ("== Lore {} ==\n'''{{{{PAGENAME}}}}''' did [[a thing|b]] {{{{cite|x=y|z}}}} "
+        "<ref>{{{{Cite web|url=http://a?b=c}}}}</ref>\n")
+
+
+def make_player(rng, i):
+    return SimpleNamespace(id=f'uuid-{i}', name=f'Player {i}', batting_stars=rng.choice([1.5, 3.0, 2.0]),
+                           pitching_stars=0.5, baserunning_stars=4.0, defense_stars=2.5,
+                           blood=rng.choice(['A', 'O', '']), coffee='Black', ritual='Yes', fate=rng.randint(1, 99),
+                           soulscream='AAAH', armor=SimpleNamespace(name=rng.choice(['None', 'Cape'])),
+                           bat=SimpleNamespace(name=rng.choice(['Vibe Check', 'Bat', ''])))
+
+
+def make_page(rng, lore_sections):
+    text = rng.choice(['', '<!-- {{Player|old=1}} -->\n', '{{Other|a={{Player}}}}\n']) + SKELETON.format(
+        batting=rng.choice(['3', '1.5', '{{x}}']),
+        extra=rng.choice(['', '| pitching=dup\n', '|positional\n']),
+        ritual=rng.choice(['Yes', '[[a|b]]', 'a {{!}} b']),
+        blood=rng.choice(['A', 'O<ref>source a|b</ref>', '<math>|x|</math>', 'A<br />B']),
+        uuid=rng.choice(['| uuid=u\n', '', ' |uuid = u\n']))
+    text += ''.join(LORE.format(k) for k in range(lore_sections))
+    if rng.random() < 0.05:  # lose the infobox's closing braces
+        text = text.replace('\n}}\n', '\n\n', 1)
+    return text
+
+
+def patch_full(player, text):
+    page = wtp.parse(text)
+    infobox.process_infobox(player, [template for template in page.templates if 'Player' in template.name])
+    return page.string
+
+
+def outcome(patch, player, text):
+    try:
+        return patch(player, text)
+    except Exception as e:
+        return type(e)
+
+
+def time_per_page(patch, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for player, text in pages:
+            patch(player, text)
+    return (time.perf_counter() - start) / (repeat * len(pages)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    pages = [(make_player(rng, i), make_page(rng, rng.choice([0, 5, 400]))) for i in range(args.pages)]
+    mismatches = [text for player, text in pages
+                  if outcome(infobox.patch_infobox, player, text) != outcome(patch_full, player, text)]
+    fast = sum(infobox.find_infobox(text) is not None for player, text in pages)
+    print(f'{len(pages)} pages, {fast} on the fast path, {len(mismatches)} different from the full parse')
+    for text in mismatches[:3]:
+        print(text[:600], '\n---')
+
+    for label, selected in [('large', [page for page in pages if len(page[1]) > 20000]),
+                            ('small', [page for page in pages if len(page[1]) < 3000])]:
+        selected = [page for page in selected if infobox.find_infobox(page[1]) is not None][:20]
+        if not selected:
+            continue
+        size = sum(len(text) for player, text in selected) // len(selected)
+        full = time_per_page(patch_full, selected, args.repeat)
+        patched = time_per_page(infobox.patch_infobox, selected, args.repeat)
+        print(f'{label} pages ({len(selected)}, {size} chars on average): full parse {full:.2f} ms/page, '
+              f'patch_infobox {patched:.2f} ms/page, {full / patched:.1f}x')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""render_template against building each GameEvent with wikitextparser's set_arg.
+
+The fields come from the recorded outcomes in tests/data/outcomes.txt, filled in the way
+get_wiki_template_string fills them (without the player and team lookups). Both renderers have
+to give the same text before they're timed.
+
+    python benchmarks/bench_render.py [--repeat 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+import wikitextparser as wtp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'wikiscripts'))
+import events  # noqa: E402
+
+OUTCOMES_FILE = os.path.join(ROOT, 'tests', 'data', 'outcomes.txt')
+
+
+def make_fields(outcome, day):
+    fields = {'Outcome': outcome, 'Season': '11', 'Day': str(day), 'Game': f'game-{day}',
+              'HomeTeam': '[[Hades Tigers]]', 'AwayTeam': '[[Philly Pies]]'}
+    outcome_type, re_match = events.classify(outcome)
+    fields['Type'] = outcome_type
+    if re_match is not None:
+        for group in ['Team1', 'Player1', 'Player2']:
+            if re_match.groupdict().get(group):
+                fields[group] = f'[[{re_match.group(group)}]]'
+                if group != 'Team1':
+                    fields[f'{group}Team'] = '[[Hades Tigers]]'
+        if re_match.groupdict().get('Notes'):
+            fields['Notes'] = re_match.group('Notes').capitalize()
+    return fields
+
+
+# get_wiki_template_string before render_template
+def render_set_arg(name, fields):
+    template = wtp.Template(f'{{{{{name}}}}}')
+    for field, value in fields.items():
+        template.set_arg(field, value)
+    return template.string
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with open(OUTCOMES_FILE, encoding='utf-8') as f:
+        outcomes = [line.rstrip('\n') for line in f if line.strip()]
+    events_fields = [make_fields(outcome, day) for day, outcome in enumerate(outcomes, 1)]
+    different = [fields for fields in events_fields
+                 if events.render_template('Template:GameEvent', fields) != render_set_arg('Template:GameEvent', fields)]
+    print(f'{len(events_fields)} events, {len(different)} rendered differently')
+    for fields in different:
+        print(f'    {fields["Outcome"]}')
+
+    corpus = events_fields * args.repeat
+    timings = {}
+    for name, render in [('wtp set_arg', render_set_arg), ('render_template', events.render_template)]:
+        start = time.perf_counter()
+        for fields in corpus:
+            render('Template:GameEvent', fields)
+        timings[name] = time.perf_counter() - start
+        print(f'{name}: {timings[name] * 1000:.0f} ms for {len(corpus)} events ({len(corpus) / timings[name]:,.0f}/s)')
+    print(f'{timings["wtp set_arg"] / timings["render_template"]:.1f}x faster')
+    return 1 if different else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
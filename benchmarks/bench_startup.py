@@ -0,0 +1,66 @@
+"""Time from `python pwb.py events` to its first API request, cold and warm.
+
+Cold runs delete pwb.py's dependency cache first, so check_modules imports pkg_resources and
+setup.py; warm runs find the cached pass. Each run is a fresh interpreter that stops the moment
+the first HTTP request is made (the login's), so nothing reaches the wiki or the Blaseball API.
+
+    python benchmarks/bench_startup.py [--runs 5] [script and args, default: events --dry_run]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PWB = os.path.join(ROOT, 'pwb.py')
+DEPENDENCY_CACHE = os.path.join(ROOT, '.pwb-dependency-cache.json')
+FIRST_REQUEST = 'first-request'
+
+# runs pwb.py as __main__, but the first request anything sends ends the process instead
+BOOTSTRAP = f'''
+import os, runpy, sys
+import requests
+
+def first_request(*args, **kwargs):
+    sys.stdout.flush()
+    print({FIRST_REQUEST!r}, flush=True)
+    os._exit(0)
+
+requests.Session.request = first_request
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def time_run(argv, cold):
+    if cold and os.path.exists(DEPENDENCY_CACHE):
+        os.unlink(DEPENDENCY_CACHE)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', BOOTSTRAP, PWB] + argv, cwd=ROOT,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - start
+    if FIRST_REQUEST not in result.stdout:
+        sys.exit(f'pwb.py {" ".join(argv)} ended without an API request:\n{result.stdout}')
+    return elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('argv', nargs='*', default=['events', '--dry_run'])
+    args = parser.parse_args()
+
+    time_run(args.argv, cold=False)  # leave a cache behind and the files in the OS cache
+    times = {}
+    for label, cold in [('cold', True), ('warm', False)]:
+        times[label] = [time_run(args.argv, cold) for _ in range(args.runs)]
+        print(f'{label}: median {statistics.median(times[label]):.0f} ms to the first API request '
+              f'(min {min(times[label]):.0f}, max {max(times[label]):.0f}, {args.runs} runs)')
+    saved = statistics.median(times['cold']) - statistics.median(times['warm'])
+    print(f'the dependency cache saves {saved:.0f} ms per run')
+
+
+if __name__ == '__main__':
+    main()
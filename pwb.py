@@ -13,6 +13,9 @@ Currently <pwb options> are global options. This can be used for tests
 to set the default site (see T216825):
 
     python pwb.py -lang:de bot_tests -v
+
+--serve[=<socket>] keeps one process logged in and runs scripts sent to it
+with --client[=<socket>] <name_of_script> <options>, see serve().
 """
 # (C) Pywikibot team, 2012-2020
 #
@@ -21,10 +24,15 @@ to set the default site (see T216825):
 
 from __future__ import print_function
 
+import hashlib
+import json
 import os
+import socket
 import sys
+import traceback
 import types
-import pywikibot
+
+from contextlib import redirect_stderr, redirect_stdout
 
 from difflib import get_close_matches
 from importlib import import_module
@@ -33,6 +41,13 @@ from warnings import warn
 
 pwb = None
 
+# check_modules remembers a passed check here, see _dependency_state
+_DEPENDENCY_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '.pwb-dependency-cache.json')
+# where --serve listens and --client connects unless given a path
+_SERVE_SOCKET = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '.pwb.sock')
+
 # The following snippet was developed by Ned Batchelder (and others)
 # for coverage [1], with python 3 support [2] added later,
 # and is available under the BSD license (see [3])
@@ -113,6 +128,53 @@ def handle_args(pwb_py, *args):
     return fname, list(args[index + int(bool(fname)):]), args[:index]
 
 
+def send_to_server(path, argv):
+    """Run a script on a --serve process and relay its output.
+
+    @return: the script's exit status
+    @rtype: int
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    with client, client.makefile('w', encoding='utf-8') as request, \
+            client.makefile('r', encoding='utf-8') as output:
+        request.write(json.dumps({'argv': argv}) + '\n')
+        request.flush()
+        for line in output:
+            if line.startswith('pwb-exit: '):
+                return int(line[len('pwb-exit: '):])
+            print(line, end='')
+    return 1
+
+
+def _client_args(argv):
+    """Find --client[=<socket>] among the global args.
+
+    @return: the socket path, the script and its args; or None
+    @rtype: tuple or None
+    """
+    filename, script_args, global_args = handle_args(*argv)
+    for arg in global_args:
+        option, _, value = arg.partition('=')
+        if option == '--client':
+            return value or _SERVE_SOCKET, filename, script_args
+    return None
+
+
+# the server has already imported pywikibot, checked the dependencies and
+# logged in, so a --client run hands its command line over before any of it
+if __name__ == '__main__':
+    _client = _client_args(sys.argv)
+    if _client is not None:
+        _path, _script, _script_args = _client
+        if not _script:
+            print(__doc__)
+            sys.exit()
+        sys.exit(send_to_server(_path, [_script] + _script_args))
+
+import pywikibot  # noqa: E402
+
+
 def _print_requirements(requirements, script, variant):
     """Print pip command to install requirements."""
     if not requirements:
@@ -131,17 +193,65 @@ def _print_requirements(requirements, script, variant):
               .format(str(requirement).partition(';')[0]))
 
 
+def _dependency_state(script):
+    """Fingerprint everything check_modules' answer depends on.
+
+    That is the Python version, the script, setup.py and the modification
+    times of the distribution metadata on sys.path, which change whenever a
+    package is installed, upgraded or removed.
+
+    @param script: The script name to be checked for dependencies
+    @type script: str or None
+    @rtype: str
+    """
+    digest = hashlib.sha1()
+    digest.update('{}\0{}\0'.format(sys.version, script).encode('utf-8'))
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'setup.py'), 'rb') as f:
+        digest.update(f.read())
+    for path in sys.path:
+        if not path or not os.path.isdir(path):
+            continue
+        with os.scandir(path) as entries:
+            metadata = sorted(
+                '{}\0{}\0{}\0'.format(path, entry.name,
+                                       entry.stat().st_mtime_ns)
+                for entry in entries
+                if entry.name.endswith(('.dist-info', '.egg-info',
+                                        '.egg-link')))
+        digest.update(''.join(metadata).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _read_dependency_cache():
+    """Return the cached check results, or an empty dict."""
+    try:
+        with open(_DEPENDENCY_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
 def check_modules(script=None):
     """Check whether mandatory modules are present.
 
     This also checks Python version when importing deptendencies from setup.py
 
+    A passed check is cached, keyed by L{_dependency_state}, so that
+    importing pkg_resources and setup.py is skipped until setup.py or the
+    installed packages change.
+
     @param script: The script name to be checked for dependencies
     @type script: str or None
     @return: True if all dependencies are installed
     @rtype: bool
     @raise RuntimeError: wrong Python version found in setup.py
     """
+    state = _dependency_state(script)
+    cache = _read_dependency_cache()
+    if cache.get(str(script)) == state:
+        return True
+
     import pkg_resources
     if script:
         from setup import script_deps
@@ -176,6 +286,15 @@ def check_modules(script=None):
         except KeyboardInterrupt:
             return False
 
+    # only a clean pass is cached, so problems are reported on every run
+    if not missing_requirements and not version_conflicts:
+        cache[str(script)] = state
+        try:
+            with open(_DEPENDENCY_CACHE, 'w') as f:
+                json.dump(cache, f)
+        except OSError:
+            pass
+
     return not missing_requirements
 
 
@@ -300,10 +419,133 @@ def find_filename(filename):
     return filename
 
 
+def _pop_socket_arg(name):
+    """Remove --<name> or --<name>=<path> from the global args.
+
+    @return: the socket path, or None if the option wasn't given
+    @rtype: str or None
+    """
+    global global_args
+    path = None
+    remaining = []
+    for arg in global_args:
+        option, _, value = arg.partition('=')
+        if option == '--' + name:
+            path = value or _SERVE_SOCKET
+        else:
+            remaining.append(arg)
+    global_args = tuple(remaining)
+    return path
+
+
+def _run_script(argv):
+    """Find and run a script the way main does, after the login.
+
+    @param argv: script name followed by its arguments
+    @type argv: list
+    @return: the script's exit status
+    @rtype: int
+    """
+    script, script_argv, _ = handle_args('pwb.py', *argv)
+    if not script:
+        print('ERROR: no script given')
+        return 2
+    if not os.path.exists(script):
+        script = find_filename(script)
+        if script is None:
+            return 2
+    if not (check_modules(script) or '-help' in script_argv):
+        return 1
+    try:
+        run_python_file(script, [script] + script_argv,
+                        [Path(script).stem] + script_argv)
+    except SystemExit as e:  # click and sys.exit() end every script with this
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code)
+        return 1
+    return 0
+
+
+def _serve_connection(conn):
+    """Run the one script a client sent and write its output back.
+
+    @raise OSError: the client went away
+    """
+    with conn, conn.makefile('r', encoding='utf-8') as request, \
+            conn.makefile('w', encoding='utf-8') as output:
+        try:
+            argv = json.loads(request.readline())['argv']
+        except (ValueError, KeyError, TypeError):
+            output.write('ERROR: expected {"argv": [...]}\npwb-exit: 2\n')
+            return
+        print('Running {}'.format(' '.join(argv)))
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                status = _run_script(argv)
+            except Exception:  # keep serving whatever a script does
+                error = traceback.format_exc()
+                status = 1
+                try:
+                    output.write(error)
+                    output.flush()
+                except OSError:  # no client to tell, so the server's log gets it
+                    sys.__stderr__.write(error)
+        output.write('pwb-exit: {}\n'.format(status))
+        output.flush()
+
+
+def serve(path):
+    """Run scripts sent over a Unix socket in this one warm interpreter.
+
+    Logs in and builds the Site once. Every script run after that gets the
+    same Site from pywikibot.Site(), with its session and caches, and the
+    modules it imports stay loaded. A client sends one line of JSON,
+    {"argv": ["events", "--dry_run"]}, and gets the script's print output
+    back, ending with a "pwb-exit: <status>" line. Scripts run one at a
+    time. pywikibot's own output and prompts stay on the server's terminal,
+    so send scripts in their non-interactive modes.
+
+    @param path: the socket to listen on
+    @type path: str
+    """
+    login = 'scripts/login.py'
+    run_python_file(login, [login], [Path(login).stem],
+                    os.path.dirname(login).replace(os.sep, '.'))
+    site = pwb.Site()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)  # only this user may send scripts
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    print('Serving scripts for {} on {}; CTRL-C to stop.'.format(site, path))
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                _serve_connection(conn)
+            except OSError as e:  # the client went away; wait for the next
+                print('Client disconnected: {}'.format(e))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+    return True
+
+
 def main():
     """Command line entry point."""
     global filename
 
+    serve_path = _pop_socket_arg('serve')
+
     if global_args:  # don't use sys.argv
         unknown_args = pwb.handle_args(global_args)
         if unknown_args:
@@ -312,6 +554,9 @@ def main():
                           ', '.join(unknown_args)))
             return False
 
+    if serve_path:
+        return serve(serve_path)
+
     if not filename:
         return False
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the wikiscripts run as top level scripts (they import each other as `teams` and so on)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wikiscripts'))
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+import wikitextparser as wtp
+
+pytest.importorskip('pywikibot')
+import events  # noqa: E402
+
+# outcome strings as the API gives them, a few of each type plus some that fit none or look like another
+OUTCOMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'outcomes.txt')
+with open(OUTCOMES_FILE, encoding='utf-8') as f:
+    OUTCOMES = [line.rstrip('\n') for line in f if line.strip()]
+
+
+# how outcomes were classified before classify: every regex in order until one matches
+def classify_sequential(outcome):
+    for outcome_type, pattern in events.outcomes_dict.items():
+        re_match = pattern.search(outcome)
+        if re_match:
+            return outcome_type, re_match
+    return 'Unknown', None
+
+
+def describe(classified):
+    outcome_type, re_match = classified
+    return outcome_type, (re_match.span(), re_match.groupdict()) if re_match else None
+
+
+@pytest.mark.parametrize('outcome', OUTCOMES)
+def test_classify_matches_sequential_search(outcome):
+    assert describe(events.classify(outcome)) == describe(classify_sequential(outcome))
+
+
+def test_outcomes_cover_every_type():
+    assert {events.classify(outcome)[0] for outcome in OUTCOMES} == set(events.outcomes_dict) | {'Unknown'}
+
+
+# what get_wiki_template_string used to build with wtp: one set_arg per field, in order
+def set_arg_template(name, fields):
+    template = wtp.Template(f'{{{{{name}}}}}')
+    for field, value in fields.items():
+        template.set_arg(field, value)
+    return template.string
+
+
+GAME_FIELDS = {'Outcome': 'Jaylen Hotdogfingers hit a ground out to Wyatt Mason.', 'Season': '11', 'Day': '99',
+               'Game': '0b7f7b4c-0ae4-4f9e-8b0f-1c6b2a47c2b9', 'HomeTeam': '[[Hades Tigers]]',
+               'AwayTeam': '[[Philly Pies]]', 'Type': 'Incineration'}
+
+
+@pytest.mark.parametrize('notes', [
+    {},
+    {'Player1': '[[Jaylen Hotdogfingers]]', 'Player1Team': '[[Philly Pies]]'},
+    {'Player1': '[[Jaylen Hotdogfingers]]', 'Player1Team': 'maybe? [[Philly Pies]]',
+     'Player2': '[[Wyatt Mason]]', 'Player2Team': 'Unknown'},
+    {'Team1': '[[Hades Tigers]]', 'Notes': 'Black hole'},
+    {'Notes': ''},
+])
+def test_render_template_matches_set_arg(notes):
+    fields = dict(GAME_FIELDS, **notes)
+    assert events.render_template('Template:GameEvent', fields) == set_arg_template('Template:GameEvent', fields)
+
+
+def test_render_template_pads_names_like_set_arg():
+    # 'Outcome' sets the length everything after it gets padded to, until shorter names outnumber it
+    fields = {'Outcome': 'x', 'Season': '1', 'Day': '2', 'Game': 'g', 'A': 'a', 'B': 'b', 'LongerName': 'c'}
+    rendered = events.render_template('Template:GameEvent', fields)
+    assert rendered == set_arg_template('Template:GameEvent', fields)
+    assert '|Season =1|Day    =2|' in rendered
+
+
+def test_render_template_escapes_markup():
+    rendered = events.render_template('Template:GameEvent', {'Outcome': 'a | b }} c'})
+    assert rendered == '{{Template:GameEvent|Outcome=a {{!}} b &#125;&#125; c}}'
+    assert wtp.Template(rendered).get_arg('Outcome').value == 'a {{!}} b &#125;&#125; c'
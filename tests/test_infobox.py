@@ -0,0 +1,376 @@
+import json
+from types import SimpleNamespace
+
+import click
+import pytest
+import wikitextparser as wtp
+
+pytest.importorskip('pywikibot')
+import infobox  # noqa: E402
+import teams  # noqa: E402
+
+
+@pytest.mark.parametrize('value, stars', [
+    (3.0, 3.0),
+    (3, 3.0),
+    ('3', 3.0),
+    ('3.0', 3.0),
+    (' 2.50 ', 2.5),
+    ('\n4.5\t', 4.5),
+    ('0', 0.0),
+    ('', None),
+    ('three', None),
+    ('{{Star Rating|3}}', None),
+])
+def test_normalize_stars(value, stars):
+    assert infobox.normalize_stars(value) == stars
+
+
+@pytest.mark.parametrize('value, stars', [
+    ('{{Star Rating|3}}', 3.0),
+    ('{{Star Rating|3.0}}', 3.0),
+    ('{{Star Rating| 2.50 }}', 2.5),
+    (' {{Star Rating|1.5}}\n', 1.5),
+    ('{{Star Rating|4.5|size=small}}', 4.5),
+    ('{{Star Rating|4.5}} <!-- as of season 11 -->', 4.5),
+    (None, None),
+    ('', None),
+    ('3', None),
+    ('{{Star Rating}}', None),
+    ('{{Star Rating|unknown}}', None),
+])
+def test_get_wiki_stars(value, stars):
+    assert infobox.get_wiki_stars(value) == stars
+
+
+@pytest.mark.parametrize('value', ['{{Star Rating|3}}', '{{Star Rating|3.0}}', '{{Star Rating| 3.00 }}',
+                                   '{{Star Rating|3|size=small}}'])
+def test_equal_stars_compare_equal(value):
+    assert infobox.get_wiki_stars(value) == infobox.normalize_stars(3.0)
+
+
+@pytest.mark.parametrize('value', ['{{Star Rating|2.5}}', '', None, '{{Star Rating|?}}', '3 stars'])
+def test_changed_or_unreadable_stars_compare_unequal(value):
+    assert infobox.get_wiki_stars(value) != infobox.normalize_stars(3.0)
+
+
+def test_format_stars():
+    assert infobox.format_stars(3.0) == '{{Star Rating|3.0}}'
+    assert infobox.format_stars(' 2.50 ') == '{{Star Rating|2.5}}'
+
+
+# add_new's page before render_new_page: an f-string with the ratings filled in, and set_arg
+# for the rest. kept here to check the skeleton against
+OLD_NEW_PAGE = """
+{{{{Template:{header}}}}} <!-- Remove this header and comment when adding community lore for the first time -->
+{{{{Player
+| title1={{{{{{PAGENAME}}}}}}
+<!-- Use the filename with the file type, but without the File: or Image: prefix-->
+| image1=
+<!-- Photo credit -->
+| caption1=
+
+<!-- Records: Basic information -->
+| aliases= <!-- IN GAME NAMES ONLY -->
+| team=[[{team_name}]]
+| former=
+| status=Active
+| dates= <!-- IRL dates active (ex. Jul 20 - Aug 31, 2020) -->
+<!-- Records: Statistical Information -->
+<!-- These are star ratings -->
+| batting={batting}
+| pitching={pitching}
+| baserunning={baserunning}
+| defense={defense}
+| modification=
+<!-- These are taken from the pop-up box on clicking the player -->
+| item=
+| armor=
+| evolution=
+| ritual={ritual}
+| coffee={coffee}
+| blood={blood}
+| fate={fate}
+| soulscream={soulscream}
+| uuid={uuid}
+<!-- For community lore info box fields, see Template:Player/doc & delete this note. -->
+}}}}
+'''{{{{PAGENAME}}}}''' is a {role} for the [[{team_name}]]{joined}
+
+<!--
+== Official League Records ==
+{last_name} joined the [[ILB]] as a {role} for the [[{team_name}]] on [[Season]], Day #
+(after the [[incineration]] of [[Incinerated Player]])
+(via the [[Season#Blessings | '''Blessing name''']] blessing).
+-->
+<!-- When adding community lore about a player, add the template {{{{Community Lore}}}} at the top of the section and delete this note. -->
+
+----
+<references />
+{{{{TeamNavSelector|{team_name}}}}}
+{{{{TeamCategorySelector|{team_name}}}}}
+<br />
+<!-- Add categories as needed. You might want:
+[[Category:Players who Replaced an Incinerated Player]]
+-->
+[[Category:Players]]
+[[Category:{new_category}]]
+    """
+UUID_COMMENT = '<!-- For community lore info box fields, see Template:Player/doc & delete this note. -->\n'
+
+
+def make_player(bat='', armor=''):
+    return SimpleNamespace(id='f70dd57b-55c4-4a62-a5ea-7cc4bf9d8ac1', name='Jessica Telephone',
+                           batting_stars=3.5, pitching_stars=0.5, baserunning_stars=4.0, defense_stars=2.5,
+                           ritual='Chess', coffee='Latte', blood='Basic', fate=57, soulscream='AAAAIIIII',
+                           bat=SimpleNamespace(name=bat), armor=SimpleNamespace(name=armor))
+
+
+def render_old(player, team_name, role, is_shadowed):
+    text = OLD_NEW_PAGE.format(
+        header='Shadows' if is_shadowed else 'New_Player_Header', team_name=team_name,
+        batting=infobox.format_stars(player.batting_stars), pitching=infobox.format_stars(player.pitching_stars),
+        baserunning=infobox.format_stars(player.baserunning_stars), defense=infobox.format_stars(player.defense_stars),
+        ritual=player.ritual, coffee=player.coffee, blood=player.blood, fate=player.fate,
+        soulscream=player.soulscream, uuid=player.id, role=role,
+        joined=' in the [[Shadows]].' if is_shadowed else ', and has been with the team since [[Season]], Day #.',
+        last_name=player.name.split(' ', 1)[1], new_category='Shadows' if is_shadowed else f'{role}s')
+    page = wtp.parse(text)
+    template = [template for template in page.templates if template.normal_name() == 'Player'][0]
+    # process_infobox as it was then, straight set_arg calls
+
+    def get_value(name):
+        arg = template.get_arg(name)
+        return arg.value if arg else None
+
+    for name, value in infobox.get_infobox_edits(player, get_value):
+        template.set_arg(name, value, preserve_spacing=True)
+    return page.string
+
+
+def render_new(monkeypatch, player, team_name, role, is_shadowed):
+    saved = []
+    monkeypatch.setattr(infobox, 'get_page', lambda site, title: title)
+    monkeypatch.setattr(infobox, 'queue_save', lambda page, text, *args: saved.append(text))
+    monkeypatch.setattr(teams, 'team_index', {})  # nobody in the registry: the plain category selector
+    monkeypatch.setattr(teams, 'team_cache_fresh', True)  # and no asking the API about it
+    infobox.add_new(player, None, True, 0, 0, team_name, role, is_shadowed)
+    return saved[0]
+
+
+@pytest.mark.parametrize('team_name, role, is_shadowed', [
+    ('Boston Flowers', 'Batter', False),
+    ('Boston Flowers', 'Pitcher', False),
+    ('Philly Pies', 'Batter', True),
+])
+def test_new_page_matches_old_path(monkeypatch, team_name, role, is_shadowed):
+    player = make_player()
+    old = render_old(player, team_name, role, is_shadowed)
+    # the only other difference: the skeleton leaves out the note after uuid
+    assert render_new(monkeypatch, player, team_name, role, is_shadowed) == old.replace(UUID_COMMENT, '')
+
+
+def test_new_page_item_and_armor_not_doubled(monkeypatch):
+    player = make_player(bat='Vibe Check', armor='Cape of Whispers')
+    new = render_new(monkeypatch, player, 'Boston Flowers', 'Batter', False)
+    assert '| item=[[Legendary Items|Vibe Check]]\n| armor=Cape of Whispers\n| evolution=\n' in new
+    # set_arg on the empty item= and armor= put the value on both sides of the newline
+    old = render_old(player, 'Boston Flowers', 'Batter', False)
+    assert ('| item=[[Legendary Items|Vibe Check]]\n[[Legendary Items|Vibe Check]]'
+            '| armor=Cape of Whispers\nCape of Whispers| evolution=\n') in old
+    assert new == old.replace(UUID_COMMENT, '').replace(
+        '\n[[Legendary Items|Vibe Check]]| armor', '\n| armor').replace('\nCape of Whispers| evolution', '\n| evolution')
+
+
+def test_new_page_drops_uuid_comment(monkeypatch):
+    new = render_new(monkeypatch, make_player(), 'Boston Flowers', 'Batter', False)
+    assert '| uuid=f70dd57b-55c4-4a62-a5ea-7cc4bf9d8ac1\n}}\n' in new
+    assert 'Template:Player/doc' not in new
+
+
+INFOBOX_PAGE = """{{Template:New_Player_Header}} <!-- note -->
+{{Player
+| title1={{{{{{PAGENAME}}}}}}
+| team=[[Boston Flowers|Flowers]]
+| batting={{Star Rating|3}}
+| pitching= {{Star Rating|0.5}}
+| baserunning={{Star Rating| 4 |size=small}}
+| defense={{Star Rating|1.5}} <!-- as of | season = 11 -->
+| item=
+| armor=None
+| ritual=Chess
+| coffee=Black
+| blood=A
+| fate=12
+| soulscream=AAAH
+| uuid=f70dd57b-55c4-4a62-a5ea-7cc4bf9d8ac1
+}}
+'''{{PAGENAME}}''' is a [[Batter|batter]]. {{Cite|a=b|c}} <ref>{{Cite web|url=http://a?b=c}}</ref>
+"""
+
+
+# what patch_infobox stands in for: parse the whole page and set the arguments on the template
+def patch_full(player, text):
+    page = wtp.parse(text)
+    infobox.process_infobox(player, [template for template in page.templates if 'Player' in template.name])
+    return page.string
+
+
+def infobox_values(text):
+    start, end, args = infobox.find_infobox(text)
+    return {name: text[start:end][value_start:value_end] for name, (value_start, value_end) in args.items()}
+
+
+def test_find_infobox_spans():
+    start, end, args = infobox.find_infobox(INFOBOX_PAGE)
+    assert INFOBOX_PAGE[start:end].startswith('{{Player\n') and INFOBOX_PAGE[start:end].endswith('\n}}')
+    values = infobox_values(INFOBOX_PAGE)
+    assert values['team'] == '[[Boston Flowers|Flowers]]\n'
+    assert values['baserunning'] == '{{Star Rating| 4 |size=small}}\n'
+    assert values['defense'] == '{{Star Rating|1.5}} <!-- as of | season = 11 -->\n'
+    assert values['item'] == '\n'
+    assert 'size' not in values and 'season' not in values and 'url' not in values
+
+
+def test_find_infobox_skips_commented_out_infobox():
+    text = '<!-- {{Player|blood=old}} -->\n{{Player|blood=new}}'
+    assert infobox_values(text) == {'blood': 'new'}
+
+
+def test_find_infobox_ignores_positional_args():
+    assert infobox_values('{{Player|positional|blood=A|[[a|b]]}}') == {'blood': 'A'}
+
+
+@pytest.mark.parametrize('text', [
+    '{{Player\n| blood=O<ref>source a|b</ref>\n}}',
+    '{{Player\n| blood=<math>|x|</math>\n}}',
+    '{{Player\n| blood=<gallery>\nA.png|a\n</gallery>\n}}',
+    '{{Player\n| blood=A\n| fate=12\n',
+    '{{Player\n| blood=A <!-- never closed }}',
+    '<nowiki>{{Player|blood=A}}</nowiki>',
+    'no infobox here',
+])
+def test_find_infobox_leaves_hard_pages_to_the_full_parse(text):
+    assert infobox.find_infobox(text) is None
+
+
+def test_find_infobox_allows_html():
+    assert infobox_values('{{Player\n| blood=A<br />B <small>c</small>\n}}') == {'blood': 'A<br />B <small>c</small>\n'}
+
+
+# an exception is an outcome too: a page neither path can make sense of has to fail the same way
+def outcome(patch, player, text):
+    try:
+        return patch(player, text)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('text', [
+    INFOBOX_PAGE,
+    INFOBOX_PAGE.replace('| item=\n', '').replace('| uuid=f70dd57b-55c4-4a62-a5ea-7cc4bf9d8ac1\n', ''),
+    INFOBOX_PAGE.replace('| blood=A\n', '| blood=O<ref>source a|b</ref>\n'),
+    INFOBOX_PAGE.replace('| blood=A\n', '| blood=<math>|x|</math>\n'),
+    INFOBOX_PAGE.replace('| ritual=Chess\n', '| ritual=a {{!}} b\n|positional\n'),
+    INFOBOX_PAGE.replace('\n}}\n', '\n\n', 1),
+    '<!-- {{Player|blood=old}} -->\n' + INFOBOX_PAGE,
+    '{{Other|a={{Player}}}}\n' + INFOBOX_PAGE,
+    '{{Player}}',
+], ids=['full', 'missing args', 'ref pipe', 'math pipe', 'escaped pipe', 'unclosed', 'commented out',
+        'nested', 'empty'])
+@pytest.mark.parametrize('bat, armor', [('', ''), ('Vibe Check', 'Cape of Whispers')])
+def test_patch_infobox_matches_full_parse(text, bat, armor):
+    player = make_player(bat, armor)
+    assert outcome(infobox.patch_infobox, player, text) == outcome(patch_full, player, text)
+
+
+def test_patch_infobox_keeps_ref_whole():
+    text = '{{Player\n| blood=O<ref>source a|b</ref>\n}}'
+    assert '| blood=Basic\n' in infobox.patch_infobox(make_player(), text)
+    assert '|b</ref>' not in infobox.patch_infobox(make_player(), text)
+
+
+def test_skip_unchanged_needs_the_uuid_redirect(monkeypatch):
+    saved, no_redirect, edited = (SimpleNamespace(id=f'id-{name}', name=f'Player {name}') for name in 'abc')
+    sweep = [(player, 'Boston Flowers', 'Batter', False) for player in (saved, no_redirect, edited)]
+    asked = []
+
+    def get_latest_revids(site, titles):
+        asked.extend(titles)
+        return {'Player_a': 10, 'id-a': 1, 'Player_b': 20, 'Player_c': 31, 'id-c': 3}
+
+    monkeypatch.setattr(infobox, 'infobox_state', object())
+    monkeypatch.setattr(infobox, 'get_fingerprint', lambda player: 'same')
+    monkeypatch.setattr(infobox, 'get_stored_fingerprint',
+                        lambda player_id: ('same', {'id-a': 10, 'id-b': 20, 'id-c': 30}[player_id]))
+    monkeypatch.setattr(infobox, 'get_latest_revids', get_latest_revids)
+    assert infobox.skip_unchanged(None, sweep) == sweep[1:]
+    assert sorted(asked) == ['Player_a', 'Player_b', 'Player_c', 'id-a', 'id-b', 'id-c']
+
+
+@pytest.mark.parametrize('approve, approved', [
+    ('all', {1, 2, 3, 4, 5}),
+    ('1', {1}),
+    ('1,3,5', {1, 3, 5}),
+    ('2-4', {2, 3, 4}),
+    ('1, 4-5', {1, 4, 5}),
+    ('3-3', {3}),
+])
+def test_get_approved(approve, approved):
+    assert infobox.get_approved(approve, 5) == approved
+
+
+@pytest.mark.parametrize('approve', ['1,', 'x', '', '0', '-3', '4-', '5-2', '1-x', '1.5'])
+def test_get_approved_rejects_bad_input(approve):
+    with pytest.raises(click.BadParameter):
+        infobox.get_approved(approve, 5)
+
+
+def test_get_approved_warns_past_the_plan(capsys):
+    assert infobox.get_approved('4-7,9', 5) == {4, 5}
+    assert 'only has 5 changes' in capsys.readouterr().out
+
+
+def snapshot_player(player_id, batting):
+    return SimpleNamespace(id=player_id, name=f'Player {player_id}', batting_stars=batting, pitching_stars=1.0,
+                           baserunning_stars=2.0, defense_stars=3.5, blood='Basic', coffee='Latte', ritual='Chess',
+                           fate=7, soulscream='AAAH', armor=SimpleNamespace(name='None'), bat=SimpleNamespace(name='Bat'))
+
+
+@pytest.fixture
+def state(monkeypatch, tmp_path):
+    monkeypatch.setattr(infobox, 'infobox_state', None)
+    return infobox.open_infobox_state(str(tmp_path / 'state.sqlite3'))
+
+
+def test_get_last_snapshot_only_reads_the_runs_it_needs(state, monkeypatch):
+    infobox.store_snapshot(infobox.make_snapshot([snapshot_player('a', 1.0), snapshot_player('b', 2.0)]))
+    for batting in (1.5, 2.5, 3.5):
+        infobox.store_snapshot(infobox.make_snapshot([snapshot_player('a', batting)]))
+    read = []
+    read_snapshot = infobox.read_snapshot
+    monkeypatch.setattr(infobox, 'read_snapshot', lambda row: read.append(row[0]) or read_snapshot(row))
+
+    last = infobox.get_last_snapshot(['a', 'b', 'new'])
+    assert last['a']['batting'] == 3.5 and last['b']['batting'] == 2.0 and 'new' not in last
+    assert sorted(read) == [1, 4]
+    read.clear()
+    assert infobox.get_last_snapshot(['new']) == {} and read == []
+
+
+def test_old_state_files_get_the_snapshot_index(state, tmp_path, monkeypatch):
+    infobox.store_snapshot(infobox.make_snapshot([snapshot_player('a', 1.0)]))
+    infobox.store_snapshot(infobox.make_snapshot([snapshot_player('a', 4.0), snapshot_player('b', 2.0)]))
+    with state:
+        state.execute('DROP TABLE snapshot_players')
+    state.close()
+    infobox.open_infobox_state(str(tmp_path / 'state.sqlite3'))
+    assert {player_id: values['batting'] for player_id, values in infobox.get_last_snapshot(['a', 'b']).items()} == \
+        {'a': 4.0, 'b': 2.0}
+
+
+def test_snapshot_survives_the_review_plan(state):
+    players = [snapshot_player('a', 1.5)]
+    snapshot = json.loads(json.dumps(infobox.make_snapshot(players)))  # the round trip through the review file
+    infobox.store_snapshot(snapshot)
+    assert infobox.diff_snapshot(infobox.get_last_snapshot(['a']), players) == {}
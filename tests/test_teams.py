@@ -0,0 +1,53 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import teams
+
+SPIES = '9debc64f-74b7-4ae1-a4d6-fce0144b6ea5'
+PIES = '23e4cbc1-e9cd-47fa-a35b-bfa06f726cb7'
+NEW_TEAM = '46358869-dce9-4a01-bfba-ac24fc56f57e'
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """The team list the API has, and a cache file written before the last team joined."""
+    league = {SPIES: ('Houston Spies', 'Spies'), PIES: ('Philly Pies', 'Pies'), NEW_TEAM: ('Atlantis Georgias', 'Georgias')}
+    calls = []
+
+    def load_all():
+        calls.append(1)
+        return {team_id: SimpleNamespace(full_name=full_name, nickname=nickname)
+                for team_id, (full_name, nickname) in league.items()}
+
+    cache_file = tmp_path / 'teams-cache.json'
+    cache_file.write_text(json.dumps([[SPIES, 'Houston Spies', 'Spies'], [PIES, 'Philly Pies', 'Pies']]))
+    monkeypatch.setattr(teams, 'TEAM_CACHE_FILE', str(cache_file))
+    monkeypatch.setattr(teams.Team, 'load_all', load_all)
+    monkeypatch.setattr(teams, 'team_index', None)
+    monkeypatch.setattr(teams, 'teams_in_order', [])
+    monkeypatch.setattr(teams, 'team_cache_fresh', False)
+    return calls
+
+
+def test_cached_teams_need_no_api(api):
+    assert teams.get_team(SPIES).full_name == 'Houston Spies'
+    assert teams.find_team('pies').id == PIES  # the alias, not a substring of 'Houston Spies'
+    assert teams.find_team('Houston').id == SPIES
+    assert api == []
+
+
+def test_unknown_team_refreshes_the_cache_once(api):
+    assert teams.find_team('Georgias').id == NEW_TEAM
+    assert teams.get_team(NEW_TEAM).full_name == 'Atlantis Georgias'
+    assert teams.find_team('Nobody') is None
+    assert teams.get_team('00000000-0000-0000-0000-000000000000') is None
+    assert len(api) == 1
+    assert NEW_TEAM in [row[0] for row in teams.read_team_cache(offline=True)]  # and the file has it now
+
+
+def test_offline_never_refreshes(api):
+    assert teams.find_team('Georgias', offline=True) is None
+    assert teams.get_team(NEW_TEAM, offline=True) is None
+    assert api == []
@@ -1,15 +1,74 @@
-from blaseball_mike.models import Game, Team, Player
+from blaseball_mike.models import Game, Team, Player, SimulationData
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+import click
+import difflib
+import gzip
+import hashlib
+import json
+import os
 import pywikibot as pwb
-import wikitextparser as wtp
 import re
+import shelve
+import sqlite3
+import teams
+import time
 
 game_record = {'season': 1, 'day': 1}
+# how many days get fetched at once when catching up, and over how many threads
+BACKFILL_WINDOW = 16
+BACKFILL_WORKERS = 8
+# names -> player ids, gamedays -> who played for whom, and team ids -> team names don't change once
+# they've happened, so they live here. open_resolve_store swaps this for a shelf that survives between runs
+resolve_store = {}
+# when set, lookups only come from resolve_store and never hit the API
+resolve_offline = False
+# our own record of what has been written to the wiki, so a run can resume and skip duplicates
+# without reading the wiki at all. open_event_state points this at a sqlite file
+event_state = None
+EVENT_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'events-state.sqlite3')
+EVENT_STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cursor (id INTEGER PRIMARY KEY CHECK (id = 0), season INTEGER, day INTEGER);
+CREATE TABLE IF NOT EXISTS games (game_id TEXT PRIMARY KEY, season INTEGER, day INTEGER);
+CREATE TABLE IF NOT EXISTS events (hash TEXT PRIMARY KEY, game_id TEXT);
+'''
+EVENT_LOG_PAGE = 'Raw Event Log'
+# --profile fills these in: seconds and calls per pipeline stage, and API round trips by call
+profiling = False
+stage_times = Counter()
+stage_calls = Counter()
+stage_stack = []
+api_calls = Counter()
+store_hits = Counter()
+last_updated_re = re.compile(r'{{\s*LastUpdated\s*\|\s*Season\s*=\s*(?P<season>\d+)\s*\|\s*Day\s*=\s*(?P<day>\d+)\s*}}')
 name_re = r'\w[\w\'\-é ]+'
 Player1_re = f'(?P<Player1>{name_re})'
 Player2_re = f'(?P<Player2>{name_re})'
 Team1_re = f'(?P<Team1>{name_re})'
 Notes_re = f'(?P<Notes>{name_re})'
-teams = Team.load_all()
+
+# counts the time spent in func towards stage_name, minus whatever nested timed calls took, so the
+# stages add up to the whole run. does nothing unless --profile is on
+def timed(stage_name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiling:
+                return func(*args, **kwargs)
+            stage_stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stage_times[stage_name] += elapsed - stage_stack.pop()
+                stage_calls[stage_name] += 1
+                if stage_stack:
+                    stage_stack[-1] += elapsed
+        return wrapper
+    return decorator
+
 
 outcomes_dict = {
     'Shelling': re.compile(f'{Player1_re} tasted the infinite and Shelled {Player2_re}!', re.IGNORECASE),
@@ -31,58 +90,167 @@ outcomes_dict = {
 }
 
 
+# a bit of text every outcome of that type has to contain, so only the regexes that can match get run.
+# checked in the same order as outcomes_dict, so the first type that matches still wins
+outcome_keywords = {
+    'Shelling': 'shelled',
+    'Incineration': 'incinerated',
+    'Shuffle': 'shuffled in the reverb',
+    'Feedback': 'feedback',
+    'Reverberating': 'reverberating',
+    'Blooddrain': 'blooddrain',
+    'Chain': 'instability',
+    'Hit By Pitch': 'with a pitch',
+    'Party': 'partying',
+    'Peanut': 'stray peanut',
+    'Red Hot': 'red hot',
+    'Deshelling': 'pecked',
+    'Big Peanut': 'big peanut',
+    'Sun 2': 'sun 2',
+    'Black Hole': 'black hole',
+    'Elsewhere': 'elsewhere'
+}
+
+
+# returns the outcome type and its match in one go
+@timed('classify')
+def classify(outcome):
+    lowered = outcome.lower()
+    for outcome_type, keyword in outcome_keywords.items():
+        if keyword in lowered:
+            re_match = outcomes_dict[outcome_type].search(outcome)
+            if re_match:
+                return outcome_type, re_match
+    return 'Unknown', None
+
+
 def detect_type(outcome):
-    for outcome_type in outcomes_dict.items():
-        if outcome_type[1].search(outcome):
-            return outcome_type[0]
-    return 'Unknown'
+    return classify(outcome)[0]
+
+
+def open_resolve_store(filename):
+    global resolve_store
+    resolve_store = shelve.open(filename)
+    return resolve_store
+
+
+def get_stored(key, load):
+    if key not in resolve_store:
+        store_hits['miss'] += 1
+        if resolve_offline:
+            raise LookupError(key)
+        value = load()
+        if not value:  # don't remember misses, the API might know better next time
+            return value
+        resolve_store[key] = value
+    else:
+        store_hits['hit'] += 1
+    return resolve_store[key]
+
+
+@lru_cache(maxsize=4096)
+@timed('resolve')
+def find_player_id(name):
+    def load():
+        api_calls['Player.find_by_name'] += 1
+        player = Player.find_by_name(name)
+        return player.id if player is not None else None
+    return get_stored(f'name:{name}', load)
+
+
+# Player.load_by_gameday fetches every player for that day anyway, so keep the whole day
+@lru_cache(maxsize=64)
+@timed('resolve')
+def get_gameday_team_ids(season, day):
+    def load():
+        api_calls['Player.load_all_by_gameday'] += 1
+        return {player_id: player.team_id for player_id, player in Player.load_all_by_gameday(season, day).items()}
+    return get_stored(f'gameday:{season}:{day}', load)
+
+
+# the shared team registry (teams.py). it comes from its own cache file, so this only reaches the
+# API the very first time. offline runs need that file to exist already
+@lru_cache(maxsize=None)
+@timed('resolve')
+def get_team_index():
+    if not resolve_offline and not os.path.exists(teams.TEAM_CACHE_FILE):
+        api_calls['Team.load_all'] += 1
+    return teams.load_teams(offline=resolve_offline)
+
+
+# same idea as Team.load_by_name (full name, nickname or alias, case insensitive) but without the API call
+def find_team_name(name):
+    try:
+        get_team_index()
+    except LookupError:
+        return None
+    team = teams.find_team(name, offline=resolve_offline)
+    return team.full_name if team is not None else None
+
+
+@lru_cache(maxsize=256)
+@timed('resolve')
+def get_team_name(team_id):
+    def load():
+        api_calls['Team.load'] += 1
+        return Team.load(team_id).full_name
+    try:
+        get_team_index()
+        team = teams.get_team(team_id, offline=resolve_offline)
+    except LookupError:
+        team = None
+    return team.full_name if team is not None else get_stored(f'team:{team_id}', load)
+
+
+# players move around, so their current team is only remembered for this run
+@lru_cache(maxsize=4096)
+@timed('resolve')
+def get_current_team_id(player_id):
+    if resolve_offline:
+        raise LookupError(player_id)
+    api_calls['Player.load_one'] += 1
+    return Player.load_one(player_id).team_id
 
 
 def set_name_and_team(re_match, group_name, game, sample):
     if group_name in re_match.groupdict() and re_match.group(group_name) is not None:
         player = re_match.group(group_name)
-        sample.set_arg(group_name, f'[[{player}]]')
-        if sample.get_arg(f'{group_name}Team') is None:
+        sample[group_name] = f'[[{player}]]'
+        if sample.get(f'{group_name}Team') is None:
             try:
-                playerObj = Player.find_by_name(player)
-                playerId = playerObj.id
-                historicalPlayerObj = Player.load_by_gameday(playerId, game.season, game.day)
-                if historicalPlayerObj is not None:
-                    teamId = historicalPlayerObj.team_id
-                    teamObj = Team.load(teamId)
-                    print(f'{player}: Found historical team data: {teamObj.full_name}')
-                    sample.set_arg(f'{group_name}Team', f'[[{teamObj.full_name}]]')
-                elif playerObj.team_id is not None:
-                    teamObj = Team.load(playerObj.team_id)
-                    print(f'{player}: Falling back to current team: {teamObj.full_name}')
-                    sample.set_arg(f'{group_name}Team', f'maybe? [[{playerObj.league_team.full_name}]]')
+                playerId = find_player_id(player)
+                if playerId is None:
+                    raise LookupError(player)  # same as any other failed lookup below
+                historicalTeamId = get_gameday_team_ids(game.season, game.day).get(playerId)
+                currentTeamId = get_current_team_id(playerId) if historicalTeamId is None else None
+                if historicalTeamId is not None:
+                    teamName = get_team_name(historicalTeamId)
+                    print(f'{player}: Found historical team data: {teamName}')
+                    sample[f'{group_name}Team'] = f'[[{teamName}]]'
+                elif currentTeamId is not None:
+                    teamName = get_team_name(currentTeamId)
+                    print(f'{player}: Falling back to current team: {teamName}')
+                    sample[f'{group_name}Team'] = f'maybe? [[{teamName}]]'
                 else:
                     print(f'Tried but failed to look up {player}')
-                    sample.set_arg(f'{group_name}Team', 'Unknown')
+                    sample[f'{group_name}Team'] = 'Unknown'
             except:
                 print(f'Failed to look up {player}')
-                sample.set_arg(f'{group_name}Team', 'Unknown')
+                sample[f'{group_name}Team'] = 'Unknown'
 
 
 def set_team_from_string(re_match, group_name, sample):
     if group_name in re_match.groupdict() and re_match.group(group_name) is not None:
-        team_name = re_match.group(group_name)
-        if team_name == 'Dalé':
-            team_name = 'Dale'
-        elif team_name == 'Pies':  # blaseball-mike cannot tell the Pies and Spies apart
-            team_name = 'Philly Pies'
-
-        team = Team.load_by_name(team_name)
+        team_name = find_team_name(re_match.group(group_name))
 
-        if team is not None:
-            sample.set_arg('Player1Team', f'[[{team.full_name}]]')
+        if team_name is not None:
+            sample['Player1Team'] = f'[[{team_name}]]'
         else:
             print('Did not use team from string')
 
 
-def set_notes(outcome, outcome_type, game, sample):
-    if outcome_type != 'Unknown' and outcomes_dict[outcome_type].search(outcome):
-        re_match = outcomes_dict[outcome_type].search(outcome)
+def set_notes(outcome, outcome_type, re_match, game, sample):
+    if re_match is not None:
         print(outcome)
         set_team_from_string(re_match, 'Team1', sample)
         set_team_from_string(re_match, 'Team2', sample)
@@ -90,92 +258,407 @@ def set_notes(outcome, outcome_type, game, sample):
         set_name_and_team(re_match, 'Player2', game, sample)
 
         if 'Notes' in re_match.groupdict():
-            sample.set_arg('Notes', re_match.group('Notes').capitalize())
+            sample['Notes'] = re_match.group('Notes').capitalize()
 
         if outcome_type == 'Shuffle':
             if 'lineup' in outcome:
-                sample.set_arg('Notes', 'Lineup')
+                sample['Notes'] = 'Lineup'
             elif 'rotation' in outcome:
-                sample.set_arg('Notes', 'Rotation')
+                sample['Notes'] = 'Rotation'
             else:
-                sample.set_arg('Notes', 'Full')
+                sample['Notes'] = 'Full'
         elif outcome_type == 'Red Hot':
             if 'no longer' in outcome:
-                sample.set_arg('Notes', 'Cooldown')
+                sample['Notes'] = 'Cooldown'
             else:
-                sample.set_arg('Notes', 'Red Hot')
+                sample['Notes'] = 'Red Hot'
         elif outcome_type == 'Elsewhere':
             if 'returned from' in outcome:
-                sample.set_arg('Notes', 'Returned')
+                sample['Notes'] = 'Returned'
             else:
-                sample.set_arg('Notes', 'Swept Away')
+                sample['Notes'] = 'Swept Away'
+
+
+# MediaWiki's own escapes, so a stray | or }} in an outcome can't break the template apart
+def escape_template_value(value):
+    return value.replace('}}', '&#125;&#125;').replace('|', '{{!}}')  # in this order, or {{!}} gets mangled
+
 
+# renders {{name|field=value|...}} straight from a dict, with the same spacing wikitextparser's
+# set_arg would give it: every new field name is padded out to the most common length so far
+def render_template(name, fields):
+    parts = ['{{', name]
+    name_lengths = []
+    for field, value in fields.items():
+        if name_lengths:
+            field = field.ljust(max(set(name_lengths), key=name_lengths.count))
+        name_lengths.append(len(field))
+        parts.append(f'|{field}={escape_template_value(value)}')
+    parts.append('}}')
+    return ''.join(parts)
 
-def get_wiki_template_string(game):
+
+# classified is an optional list of classify() results lined up with game.outcomes
+@timed('render')
+def get_wiki_template_string(game, classified=None):
     template_strings = []
-    for outcome in game.outcomes:
-        sample = wtp.Template('{{Template:GameEvent}}')
-        sample.set_arg('Outcome', outcome)
-        sample.set_arg('Season', str(game.season))
-        sample.set_arg('Day', str(game.day))
-        sample.set_arg('Game', str(game.id))
-        sample.set_arg('HomeTeam', f'[[{game.home_team.full_name}]]')
-        sample.set_arg('AwayTeam', f'[[{game.away_team.full_name}]]')
+    for idx, outcome in enumerate(game.outcomes):
+        sample = {}
+        sample['Outcome'] = outcome
+        sample['Season'] = str(game.season)
+        sample['Day'] = str(game.day)
+        sample['Game'] = str(game.id)
+        sample['HomeTeam'] = f'[[{game.home_team_name}]]'
+        sample['AwayTeam'] = f'[[{game.away_team_name}]]'
         # idk process shit???
-        outcome_type = detect_type(outcome)
-        sample.set_arg('Type', outcome_type)
-        set_notes(outcome, outcome_type, game, sample)
-        template_strings.append(sample.string)
+        outcome_type, re_match = classified[idx] if classified is not None else classify(outcome)
+        sample['Type'] = outcome_type
+        set_notes(outcome, outcome_type, re_match, game, sample)
+        template_strings.append(render_template('Template:GameEvent', sample))
     template_strings.reverse()
     return template_strings
 
 
-# get game, NOT zero indexed!
-def get_game_outcomes(season, day):
-    games = Game.load_by_day(season, day)
-    games_all_ended = True in (game.finalized for uuid, game in games.items())
+def open_event_state(filename):
+    global event_state
+    event_state = sqlite3.connect(filename)
+    event_state.executescript(EVENT_STATE_SCHEMA)
+    return event_state
 
-    print(f'Processing Season {season} Day {day}')
 
-    if not bool(games) and day != 1:
-        return get_game_outcomes(season + 1, 1)
-    elif bool(games) and (games_all_ended or season != 13):
-        game_record['season'] = season
-        game_record['day'] = day
-        outcomes = [get_wiki_template_string(game) for uuid, game in games.items() if len(game.outcomes) > 0]
-        flat_outcomes = [item for sublist in outcomes for item in sublist]
-        return get_game_outcomes(season, day + 1) + flat_outcomes
-    else:
+# the last (season, day) written, or None if there's no local state yet
+def get_state_cursor():
+    if event_state is None:
+        return None
+    return event_state.execute('SELECT season, day FROM cursor').fetchone()
+
+
+def set_state_cursor(season, day):
+    if event_state is not None:
+        with event_state:
+            event_state.execute('INSERT OR REPLACE INTO cursor VALUES (0, ?, ?)', (season, day))
+
+
+def hash_event(event):
+    return hashlib.sha1(event.encode('utf-8')).hexdigest()
+
+
+def is_game_emitted(game_id):
+    return event_state is not None and \
+        event_state.execute('SELECT 1 FROM games WHERE game_id = ?', (game_id,)).fetchone() is not None
+
+
+def is_event_emitted(event):
+    return event_state is not None and \
+        event_state.execute('SELECT 1 FROM events WHERE hash = ?', (hash_event(event),)).fetchone() is not None
+
+
+# days is a list of (day, {game id: GameEvent strings}) that just got saved to the season's shard
+def record_emitted(season, days):
+    if event_state is None:
+        return
+    with event_state:
+        for day, day_games in days:
+            for game_id, events in day_games.items():
+                event_state.execute('INSERT OR IGNORE INTO games VALUES (?, ?, ?)', (game_id, season, day))
+                event_state.executemany('INSERT OR IGNORE INTO events VALUES (?, ?)',
+                                        ((hash_event(event), game_id) for event in events))
+
+
+# Game.load_by_day is one round trip per day, so fan a window of days out over a small pool.
+# pool.map keeps the results in the same order as the days that were asked for
+@timed('fetch')
+def load_days(days, workers=BACKFILL_WORKERS):
+    api_calls['Game.load_by_day'] += len(days)
+    if workers <= 1 or len(days) <= 1:
+        return [Game.load_by_day(season, day) for season, day in days]
+    with ThreadPoolExecutor(max_workers=min(workers, len(days))) as pool:
+        return list(pool.map(lambda season_day: Game.load_by_day(*season_day), days))
+
+
+# where the sim is now, both 1-indexed
+@timed('fetch')
+def get_current_day():
+    api_calls['SimulationData.load'] += 1
+    sim = SimulationData.load()
+    return sim.season, sim.day + 1  # sim.day is zero indexed
+
+
+# the next window of (season, day) pairs worth fetching. the current season stops at today,
+# older seasons don't say how long they were so we just fetch until we hit an empty day
+def get_day_window(season, day, current_season, current_day):
+    if season > current_season:
         return []
+    last_day = day + BACKFILL_WINDOW - 1
+    if season == current_season:
+        last_day = min(last_day, current_day)
+    return [(season, window_day) for window_day in range(day, last_day + 1)]
 
 
-def get_last_date():
-    # Fetch the correct Template from the wiki
-    site = pwb.Site()
-    page = pwb.Page(site, 'Raw Event Log')
+# get game, NOT zero indexed! yields each day's {game id: GameEvent strings}, oldest day first.
+# games that were already written in an earlier run are skipped
+def get_game_outcomes(season, day, workers=BACKFILL_WORKERS):
+    current_season, current_day = get_current_day()
+
+    while True:
+        days = get_day_window(season, day, current_season, current_day)
+        if not days:
+            return
+
+        for (games_season, games_day), games in zip(days, load_days(days, workers)):
+            games_all_ended = True in (game.finalized for uuid, game in games.items())
+
+            print(f'Processing Season {games_season} Day {games_day}')
+
+            if not bool(games) and games_day != 1:
+                season, day = games_season + 1, 1
+                break
+            elif bool(games) and (games_all_ended or games_season != current_season):
+                game_record['season'] = games_season
+                game_record['day'] = games_day
+                season, day = games_season, games_day + 1
+                day_games = {uuid: get_wiki_template_string(game) for uuid, game in games.items()
+                             if len(game.outcomes) > 0 and not is_game_emitted(uuid)}
+                if day_games:
+                    yield day_games
+            else:
+                return
+
+
+# the index page only holds the LastUpdated cursor and transcludes one shard page per season,
+# so a run reads the small index and prepends to the newest shard instead of rewriting everything
+def get_shard_title(season):
+    return f'{EVENT_LOG_PAGE}/Season {season}'
+
+
+def get_shard_transclusion(season):
+    return f'{{{{:{get_shard_title(season)}}}}}'
+
+
+# events from before the shards were still inline on the index, under the cursor and the transclusions.
+# the first run that finds any moves them onto this page, oldest of all, so the index stays small from then on
+LEGACY_SHARD_TITLE = f'{EVENT_LOG_PAGE}/Legacy'
+shard_transclusion_re = re.compile(rf'{{{{:{re.escape(EVENT_LOG_PAGE)}/[^{{}}]*}}}}')
+
+
+# returns the index text with the inline events swapped for a transclusion of the legacy page, and those
+# events (None if there aren't any)
+def split_legacy_events(index_text, last_game):
+    lines = index_text[last_game.end():].split('\n')
+    shards = [line.strip() for line in lines if shard_transclusion_re.fullmatch(line.strip())]
+    events = '\n'.join(line for line in lines if not shard_transclusion_re.fullmatch(line.strip())).strip()
+    if not events:
+        return index_text, None
+    shards.append(f'{{{{:{LEGACY_SHARD_TITLE}}}}}')
+    return index_text[:last_game.end()] + '\n' + '\n'.join(shards) + '\n', events + '\n'
+
+
+# a local dump of games, one game per line: either the game JSON itself or a chronicler
+# {"gameId": ..., "data": {...}} record. gzipped files are fine too
+def load_archive(filename):
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            if line.strip():
+                data = json.loads(line)
+                yield Game(data.get('data', data))
+
+
+# re-render archived games without touching the network. players and teams are only looked up
+# in the resolve store, so pass --cache_file from an earlier live run to get them filled in
+def process_archive(filename, output):
+    global resolve_offline
+    resolve_offline = True
+
+    games = [game for game in load_archive(filename) if len(game.outcomes) > 0]
+
+    # classify everything first, grouped by type, before any templating happens
+    classified = {game.id: [classify(outcome) for outcome in game.outcomes] for game in games}
+    outcomes_by_type = {}
+    for game in games:
+        for outcome, (outcome_type, re_match) in zip(game.outcomes, classified[game.id]):
+            outcomes_by_type.setdefault(outcome_type, []).append(outcome)
+    for outcome_type, outcomes in sorted(outcomes_by_type.items(), key=lambda item: -len(item[1])):
+        print(f'{outcome_type}: {len(outcomes)}')
 
-    # lol I made an empty template to hide some values
-    last_game = wtp.parse(page.get()).templates[0]
-    # i dont know how python works tbh
-    game_record['season'] = int(last_game.arguments[0].value)
-    game_record['day'] = int(last_game.arguments[1].value)
+    # same layout as the shard pages, newest day first
+    games_by_day = {}
+    for game in games:
+        games_by_day.setdefault((game.season, game.day), []).append(game)
+    with open(output, 'w', encoding='utf-8') as out:
+        for season_day in sorted(games_by_day, reverse=True):
+            for game in games_by_day[season_day]:
+                for event in get_wiki_template_string(game, classified[game.id]):
+                    out.write(event + '\n')
+    print(f'Wrote {sum(len(outcomes) for outcomes in outcomes_by_type.values())} events to {output}')
 
-    outcomes = get_game_outcomes(game_record['season'], game_record['day'] + 1)
 
-    new_last_updated = f'{{{{LastUpdated|Season={game_record["season"]}|Day={game_record["day"]}}}}}\n'
-    new_outcomes = new_last_updated + "\n".join(outcomes)
+@timed('wiki')
+def get_index_cursor(page):
+    index_text = page.get()
+    return index_text, last_updated_re.search(index_text)
 
-    if (game_record['season'] != int(last_game.arguments[0].value) or game_record['day'] != int(last_game.arguments[1].value)):
+
+@timed('wiki')
+def save_events(site, season, new_outcomes, summary):
+    site.editpage(pwb.Page(site, get_shard_title(season)), summary=summary, minor=True, prependtext=new_outcomes)
+
+
+@timed('wiki')
+def save_index(page, text, summary):
+    page.put(text, summary=summary, minor=True)
+
+
+@timed('wiki')
+def save_legacy_events(site, events):
+    pwb.Page(site, LEGACY_SHARD_TITLE).put(events, summary=f'Move the inline events off {EVENT_LOG_PAGE}', minor=True)
+
+
+# with a delta_file nothing gets saved: the would-be edits are written there instead,
+# and the local state is left alone so the real run still has everything to do
+def save_shard_days(site, season, days, delta=None):
+    """Prepend a season's (day, games) list to its shard, or add it to delta on a dry run."""
+    summary = f'Automated event update up to S{season}G{days[-1][0]}'
+    # newest day goes first on the page, and anything we've already written stays out
+    day_blocks = ['\n'.join(event for events in day_games.values() for event in events if not is_event_emitted(event))
+                  for day, day_games in reversed(days)]
+    day_blocks = [day_block for day_block in day_blocks if day_block]
+    if day_blocks:
+        new_outcomes = '\n'.join(day_blocks) + '\n'
         print(new_outcomes)
-        page.put(page.text.replace(last_game.string, new_outcomes),
-                 summary=f"Automated event update up to S{game_record['season']}G{game_record['day']}", minor=True)
+        if delta is not None:
+            delta.append(f'== Prepend to {get_shard_title(season)} ==\n{new_outcomes}')
+        else:
+            save_events(site, season, new_outcomes, summary)
+    if delta is None:
+        record_emitted(season, days)
+
+
+def get_last_date(delta_file=None):
+    # Fetch the correct Template from the wiki
+    site = pwb.Site()
+    page = pwb.Page(site, EVENT_LOG_PAGE)
+    index_text, last_game = None, None
+
+    # pick up from the local state if we have it, otherwise see where the wiki got to
+    state_cursor = get_state_cursor()
+    if state_cursor is not None:
+        last_season, last_day = state_cursor
     else:
+        # lol I made an empty template to hide some values
+        index_text, last_game = get_index_cursor(page)
+        if last_game is None:
+            print(f'Could not find the LastUpdated template on {EVENT_LOG_PAGE}')
+            return
+        last_season, last_day = int(last_game.group('season')), int(last_game.group('day'))
+    game_record['season'] = last_season
+    game_record['day'] = last_day
+
+    # save each season's shard as soon as the games move past it, so only one season is held at a time
+    delta, seasons, shard_days = [], [], []
+    dry_delta = delta if delta_file else None
+    for day_games in get_game_outcomes(last_season, last_day + 1):
+        if not seasons or game_record['season'] != seasons[-1]:
+            if shard_days:
+                save_shard_days(site, seasons[-1], shard_days, dry_delta)
+                shard_days = []
+            if index_text is None:
+                # don't save any shard until we know the index has a cursor to move
+                index_text, last_game = get_index_cursor(page)
+                if last_game is None:
+                    print(f'Could not find the LastUpdated template on {EVENT_LOG_PAGE}')
+                    return
+            seasons.append(game_record['season'])
+        shard_days.append((game_record['day'], day_games))
+
+    if game_record['season'] == last_season and game_record['day'] == last_day:
         print('No need to update...')
+        return
+    if shard_days:
+        save_shard_days(site, seasons[-1], shard_days, dry_delta)
+    if index_text is None:
+        index_text, last_game = get_index_cursor(page)
+        if last_game is None:
+            print(f'Could not find the LastUpdated template on {EVENT_LOG_PAGE}')
+            return
+
+    (index_text, legacy_events) = split_legacy_events(index_text, last_game)
+    last_game = last_updated_re.search(index_text)
+    summary = f"Automated event update up to S{game_record['season']}G{game_record['day']}"
+
+    # only move the cursor once the events are saved, and list any new shards under it
+    new_last_updated = f'{{{{LastUpdated|Season={game_record["season"]}|Day={game_record["day"]}}}}}'
+    new_shards = ''.join(f'\n{get_shard_transclusion(season)}' for season in sorted(seasons, reverse=True)
+                         if get_shard_transclusion(season) not in index_text)
+    new_index_text = index_text.replace(last_game.group(0), new_last_updated + new_shards, 1)
+    if delta_file:
+        index_diff = difflib.unified_diff(index_text.splitlines(), new_index_text.splitlines(), lineterm='', n=1)
+        if legacy_events:
+            delta.append(f'== Move {len(legacy_events.splitlines())} lines of inline events to {LEGACY_SHARD_TITLE} ==\n')
+        delta.append(f'== Edit {EVENT_LOG_PAGE} ==\n' + '\n'.join(index_diff) + '\n')
+        with open(delta_file, 'w', encoding='utf-8') as out:
+            out.write('\n'.join(delta))
+        print(f'Dry run, nothing saved. Would-be changes are in {delta_file}')
+        return
+    if legacy_events:
+        # the legacy page has to exist before the index stops holding its events
+        save_legacy_events(site, legacy_events)
+    save_index(page, new_index_text, summary)
+    set_state_cursor(game_record['season'], game_record['day'])
 
 
-def main():
+def print_profile(total_time):
+    print(f'{"Stage":<10}{"Seconds":>10}{"Calls":>10}')
+    for stage_name, seconds in stage_times.most_common():
+        print(f'{stage_name:<10}{seconds:>10.2f}{stage_calls[stage_name]:>10}')
+    print(f'{"other":<10}{total_time - sum(stage_times.values()):>10.2f}')
+    print(f'{"total":<10}{total_time:>10.2f}')
+
+    print(f'API calls: {sum(api_calls.values())}')
+    for call, count in api_calls.most_common():
+        print(f'    {call}: {count}')
+
+    print('Cache hits:')
+    for func in (find_player_id, get_gameday_team_ids, get_team_index, get_team_name, get_current_team_id):
+        info = func.cache_info()
+        lookups = info.hits + info.misses
+        print(f'    {func.__name__}: {info.hits}/{lookups}' + (f' ({info.hits / lookups:.0%})' if lookups else ''))
+    lookups = store_hits['hit'] + store_hits['miss']
+    print(f'    resolve store: {store_hits["hit"]}/{lookups}' + (f' ({store_hits["hit"] / lookups:.0%})' if lookups else ''))
+
+
+# Command line parsing
+@click.command()
+@click.option('--cache_file', help='Remember resolved players and teams in this file between runs')
+@click.option('--state_file', default=EVENT_STATE_FILE, show_default=True,
+              help='Local record of what has been written, so runs can resume without reading the wiki')
+@click.option('--no_state', is_flag=True, help='Ignore the local state and go by the wiki\'s LastUpdated template')
+@click.option('--archive', help='Re-render games from a local JSON Lines dump instead of the live API, without saving')
+@click.option('--output', default='events-archive.txt', show_default=True, help='Where --archive writes its events')
+@click.option('--dry_run', is_flag=True, help='Fetch, classify, resolve and render, but write the edits to --delta_file instead of saving')
+@click.option('--delta_file', default='events-delta.txt', show_default=True, help='Where --dry_run writes the would-be edits')
+@click.option('--profile', is_flag=True, help='Print time per stage, API calls and cache hit rates at the end')
+def main(cache_file, state_file, no_state, archive, output, dry_run, delta_file, profile):
+    global profiling
+    profiling = profile
+    start = time.perf_counter()
     #  info.prefill_player_infos(teams)
-    get_last_date()
+    if cache_file:
+        open_resolve_store(cache_file)
+    if not no_state and not archive:
+        open_event_state(state_file)
+    try:
+        if archive:
+            process_archive(archive, output)
+        else:
+            get_last_date(delta_file if dry_run else None)
+    finally:
+        if cache_file:
+            resolve_store.close()
+        if event_state is not None:
+            event_state.close()
+        if profile:
+            print_profile(time.perf_counter() - start)
 
 
 # To victory
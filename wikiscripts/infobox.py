@@ -1,14 +1,560 @@
-from blaseball_mike.models import Team, Player
+from array import array
+from blaseball_mike import database
+from blaseball_mike.models import Item, Team, Player
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import click
+import difflib
+import hashlib
+import json
+import os
 import pywikibot as pwb
 from pywikibot.bot_choice import QuitKeyboardInterrupt
+from pywikibot.data import api
+from pywikibot.exceptions import FatalServerError, OtherPageSaveError, PageSaveRelatedError, ServerError
+from pywikibot.exceptions import TimeoutError as PwbTimeoutError
 from pywikibot.tools.formatter import color_format
 import wikitextparser as wtp
+import queue
+import re
+import sqlite3
+import string
 import sys
+import teams
+import threading
+import time
+import zlib
 
 
 # python pwb.py protect -cat:Shadows -edit:sysop -summary: "Locking Shadows Players"
 
+# how many players to ask the API for in one request, and how many single loads to run at once if that fails
+PLAYER_CHUNK = 50
+PLAYER_WORKERS = 8
+# what we last left on each player's page: a hash of the fields infobox.py fills in, and the revision
+# it ended up at. if neither has moved since, the page can be skipped without even fetching it.
+# open_infobox_state points this at a sqlite file
+infobox_state = None
+infobox_state_lock = threading.Lock()
+INFOBOX_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'infobox-state.sqlite3')
+# it also keeps the league roster as of the last full run, so --roster_diff can tell who was added or moved
+INFOBOX_STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fingerprints (player_id TEXT PRIMARY KEY, fingerprint TEXT, revid INTEGER);
+CREATE TABLE IF NOT EXISTS rosters (player_id TEXT PRIMARY KEY, team_name TEXT, role TEXT, shadowed INTEGER);
+CREATE TABLE IF NOT EXISTS snapshots (run INTEGER PRIMARY KEY, taken REAL, player_ids TEXT,
+    batting BLOB, pitching BLOB, baserunning BLOB, defense BLOB, details BLOB);
+CREATE TABLE IF NOT EXISTS snapshot_players (player_id TEXT PRIMARY KEY, run INTEGER);
+'''
+# and every player it fetched, one row per run. the star columns are arrays of tenths of a star
+# (two bytes a player), the rest is compressed json, so a season of runs stays a few MB
+# snapshot_players is the last run each player turned up in, so finding someone's latest snapshot
+# doesn't mean unpacking every run since
+SNAPSHOT_STARS = ['batting', 'pitching', 'baserunning', 'defense']
+SNAPSHOT_DETAILS = ['name', 'blood', 'coffee', 'ritual', 'fate', 'soulscream', 'armor', 'item']
+# saves go through a bounded queue to one worker thread, so working out the next diff doesn't wait
+# on pywikibot's put throttle. the queue filling up is what slows the sweep down instead
+SAVE_QUEUE_SIZE = 20
+SAVE_RETRIES = 3
+save_queue = queue.Queue(maxsize=SAVE_QUEUE_SIZE)
+save_worker = None
+save_stats = Counter()
+save_latencies = []
+# with --review, every save queue_save is given ends up in here instead of on the wiki
+review_plan = None
+REVIEW_FILE = 'infobox-review.json'
+# pages that preload_pages already fetched, keyed by the title they were asked for with
+preloaded_pages = {}
+# for patch_infobox: where the infobox starts, and the pieces of wikitext that matter for finding its arguments
+infobox_start_re = re.compile(r'\{\{\s*(?:[Tt]emplate\s*:\s*)?Player\s*(?=\||\}\})')
+infobox_token_re = re.compile(r'<!--.*?(?:-->|\Z)|\{\{|\}\}|\[\[|\]\]|\||=', re.DOTALL)
+# a pipe inside an extension tag (<ref>, <math>, <gallery>...) doesn't split template arguments, and which
+# tags are extensions depends on the wiki. so find_infobox only handles tags from this list of plain HTML
+html_tag_re = re.compile(r'</?(?!(?:b|big|br|center|code|del|div|em|font|hr|i|ins|li|ol|p|s|small|span|strike|'
+                         r'strong|sub|sup|table|td|th|tr|tt|u|ul)\b)[A-Za-z]', re.IGNORECASE)
+star_rating_re = re.compile(r'\{\{Star Rating\|([^{}|=]*)\}\}')
+WS = '\r\n\t '  # what wikitextparser strips around names and values
+
+
+def get_page(site, title):
+    if title in preloaded_pages:
+        return preloaded_pages[title]
+    return pwb.Page(site, title)
+
+
+# fetch every player's page and UUID redirect in batched queries before editing anything,
+# so exists() and get() afterwards are answered from memory
+def preload_pages(site, players):
+    titles = []
+    for player in players:
+        titles += [player.id, player.name.replace(' ', '_')]
+    pages = [pwb.Page(site, title) for title in titles]
+    for page in site.preloadpages(pages, groupsize=50):
+        pass
+    preloaded_pages.update(zip(titles, pages))
+
+
+# Player.load takes a whole list of ids in one request, so load a chunk at a time.
+# if a chunk fails, fall back to loading those players one by one over a small pool
+# None instead of an exception, so one bad id in the fallback doesn't stop the other loads
+def load_one_player(player_id):
+    try:
+        return Player.load_one(player_id)
+    except Exception as e:
+        print(f'Loading player {player_id} failed: {e}')
+        return None
+
+
+def load_players(player_ids):
+    players = {}
+    for start in range(0, len(player_ids), PLAYER_CHUNK):
+        chunk = player_ids[start:start + PLAYER_CHUNK]
+        try:
+            players.update(Player.load(*chunk))
+        except Exception as e:
+            print(f'Bulk load failed ({e}), loading {len(chunk)} players one at a time')
+            with ThreadPoolExecutor(max_workers=min(PLAYER_WORKERS, len(chunk))) as pool:
+                players.update(zip(chunk, pool.map(load_one_player, chunk)))
+    return [players.get(player_id) for player_id in player_ids]
+
+
+# blood, coffee, bat and armor are each a separate request the first time they're read, and the
+# fingerprint, the snapshot and the infobox all read them. fetch them for the whole sweep in one
+# request per kind instead. whatever this misses still gets lazy loaded as before
+def load_player_details(players):
+    for kind, get in [('blood', database.get_blood), ('coffee', database.get_coffee)]:
+        # an id is a number to look up; some players already have the name itself in there
+        pending = [player for player in players if isinstance(getattr(player, f'_{kind}_id', None), int)]
+        ids = sorted({str(getattr(player, f'_{kind}_id')) for player in pending})
+        if not ids:
+            continue
+        try:
+            names = get(ids)
+        except Exception as e:
+            print(f'Could not load {kind} ({e})')
+            continue
+        if len(names) != len(ids):  # the names come back in order, with nothing to match them up by otherwise
+            continue
+        names = dict(zip(ids, names))
+        for player in pending:
+            setattr(player, f'_{kind}', names[str(getattr(player, f'_{kind}_id'))])
+    item_ids = sorted({getattr(player, f'_{kind}_id', None) for player in players for kind in ['bat', 'armor']} - {None, ''})
+    items = {}
+    for start in range(0, len(item_ids), PLAYER_CHUNK):
+        try:
+            items.update((item.id, item) for item in Item.load(*item_ids[start:start + PLAYER_CHUNK]))
+        except Exception as e:
+            print(f'Could not load items ({e})')
+    for player in players:
+        for kind in ['bat', 'armor']:
+            item = items.get(getattr(player, f'_{kind}_id', None))
+            if item is not None:
+                setattr(player, f'_{kind}', item)
+
+
+def open_infobox_state(filename):
+    global infobox_state
+    # saves finish on the save worker's thread, which records them in run_saves
+    infobox_state = sqlite3.connect(filename, check_same_thread=False)
+    infobox_state.executescript(INFOBOX_STATE_SCHEMA)
+    if infobox_state.execute('SELECT NOT EXISTS (SELECT 1 FROM snapshot_players) '
+                             'AND EXISTS (SELECT 1 FROM snapshots)').fetchone()[0]:
+        index_snapshots()  # a state file from before snapshot_players
+    return infobox_state
+
+
+def get_fingerprint(player):
+    fields = [player.batting_stars, player.pitching_stars, player.baserunning_stars, player.defense_stars,
+              player.blood, player.coffee, player.ritual, player.fate, player.soulscream,
+              player.armor.name, player.bat.name]
+    return hashlib.sha1('\x1f'.join(str(field) for field in fields).encode('utf-8')).hexdigest()
+
+
+# (fingerprint, revid) from the last run, or None
+def get_stored_fingerprint(player_id):
+    if infobox_state is None:
+        return None
+    with infobox_state_lock:
+        return infobox_state.execute('SELECT fingerprint, revid FROM fingerprints WHERE player_id = ?',
+                                     (player_id,)).fetchone()
+
+
+def store_fingerprint(player_id, fingerprint, page):
+    if infobox_state is None:
+        return
+    with infobox_state_lock, infobox_state:
+        infobox_state.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)',
+                              (player_id, fingerprint, page.latest_revision_id))
+
+
+# latest revision id for each title, from info-only queries so no page content gets downloaded
+def get_latest_revids(site, titles):
+    canonical = {pwb.Page(site, title).title(): title for title in titles}
+    canonical_titles = list(canonical)
+    revids = {}
+    for start in range(0, len(canonical_titles), 50):
+        info = api.PropertyGenerator('info', site=site, parameters={'titles': canonical_titles[start:start + 50]})
+        for pagedata in info:
+            if pagedata.get('title') in canonical and 'lastrevid' in pagedata:
+                revids[canonical[pagedata['title']]] = pagedata['lastrevid']
+    return revids
+
+
+# drop everyone whose API data and wiki page are both exactly as we left them last time. the fingerprint
+# only covers the player page, so their UUID redirect has to be there as well: if saving it failed, it's retried
+def skip_unchanged(site, sweep):
+    if infobox_state is None:
+        return sweep
+    maybe_unchanged = {}
+    for player, team_name, role, is_shadowed in sweep:
+        stored = get_stored_fingerprint(player.id)
+        if stored is not None and stored[0] == get_fingerprint(player):
+            maybe_unchanged[player.name.replace(' ', '_')] = stored[1]
+    if not maybe_unchanged:
+        return sweep
+
+    redirects = [player.id for player, team_name, role, is_shadowed in sweep
+                 if player.name.replace(' ', '_') in maybe_unchanged]
+    revids = get_latest_revids(site, list(maybe_unchanged) + redirects)
+    remaining = []
+    for player, team_name, role, is_shadowed in sweep:
+        title = player.name.replace(' ', '_')
+        if title in maybe_unchanged and revids.get(title) == maybe_unchanged[title] and player.id in revids:
+            print(f'skipping {player.name}, nothing changed since the last run')
+        else:
+            remaining.append((player, team_name, role, is_shadowed))
+    return remaining
+
+
+# everyone on an ILB team right now: {player id: (team name, role, is shadowed)}.
+# Team.load_all also has historical and tournament teams, whose rosters overlap the league's,
+# so only teams the registry has a nav for count (same as reverb.update_all_navs).
+# the _ids lists are what team.lineup etc. would load one team at a time
+def get_league_roster(league_teams):
+    roster = {}
+    for team in league_teams.values():
+        if teams.get_nav(team.id) is None:
+            continue
+        for batter_id in team._lineup_ids:
+            roster[batter_id] = (team.full_name, 'Batter', False)
+        for pitcher_id in team._rotation_ids:
+            roster[pitcher_id] = (team.full_name, 'Pitcher', False)
+        for batter_id in team._bench_ids:
+            roster[batter_id] = (team.full_name, 'Batter', True)
+        for pitcher_id in team._bullpen_ids:
+            roster[pitcher_id] = (team.full_name, 'Pitcher', True)
+    return roster
+
+
+def get_stored_roster():
+    if infobox_state is None:
+        return {}
+    with infobox_state_lock:
+        rows = infobox_state.execute('SELECT player_id, team_name, role, shadowed FROM rosters').fetchall()
+    return {player_id: (team_name, role, bool(shadowed)) for player_id, team_name, role, shadowed in rows}
+
+
+def store_roster(roster):
+    if infobox_state is None:
+        return
+    with infobox_state_lock, infobox_state:
+        infobox_state.execute('DELETE FROM rosters')
+        infobox_state.executemany('INSERT INTO rosters VALUES (?, ?, ?, ?)',
+                                  [(player_id, team_name, role, int(is_shadowed))
+                                   for player_id, (team_name, role, is_shadowed) in roster.items()])
+
+
+# keep only the players who joined the league, moved team/role/shadows, or whose
+# infobox fields changed since the last run
+def diff_roster(sweep, stored_roster, snapshot_changes):
+    counts = Counter()
+    remaining = []
+    for player, team_name, role, is_shadowed in sweep:
+        if player.id not in stored_roster:
+            counts['added'] += 1
+        elif stored_roster[player.id] != (team_name, role, is_shadowed):
+            counts['moved'] += 1
+        elif (get_stored_fingerprint(player.id) or (None,))[0] != get_fingerprint(player):
+            counts['changed'] += 1
+            if player.id in snapshot_changes:
+                print(f'{player.name}: ' + ', '.join(f'{field} {before} -> {now}'
+                                                    for field, before, now in snapshot_changes[player.id]))
+        else:
+            counts['unchanged'] += 1
+            continue
+        remaining.append((player, team_name, role, is_shadowed))
+    print(f'Roster diff: {counts["added"]} added, {counts["moved"]} moved, {counts["changed"]} changed, '
+          f'{counts["unchanged"]} unchanged')
+    return remaining
+
+
+def get_snapshot_details(player):
+    return [player.name, str(player.blood), str(player.coffee), str(player.ritual), str(player.fate),
+            str(player.soulscream), player.armor.name, player.bat.name]
+
+
+# what store_snapshot writes, in a form that can wait in a --review plan until --apply
+def make_snapshot(players):
+    return {'taken': time.time(), 'player_ids': [player.id for player in players],
+            'stars': [[round(getattr(player, f'{name}_stars') * 10) for player in players] for name in SNAPSHOT_STARS],
+            'details': [get_snapshot_details(player) for player in players]}
+
+
+def store_snapshot(snapshot):
+    if infobox_state is None or not snapshot or not snapshot['player_ids']:
+        return
+    with infobox_state_lock, infobox_state:
+        infobox_state.execute('INSERT INTO snapshots (taken, player_ids, batting, pitching, baserunning, defense, details) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (snapshot['taken'], '\n'.join(snapshot['player_ids']),
+                               *[array('H', column).tobytes() for column in snapshot['stars']],
+                               zlib.compress(json.dumps(snapshot['details']).encode('utf-8'))))
+        run = infobox_state.execute('SELECT last_insert_rowid()').fetchone()[0]
+        infobox_state.executemany('INSERT OR REPLACE INTO snapshot_players VALUES (?, ?)',
+                                  [(player_id, run) for player_id in snapshot['player_ids']])
+
+
+# fill snapshot_players in from the snapshots themselves
+def index_snapshots():
+    with infobox_state_lock, infobox_state:
+        for run, player_ids in infobox_state.execute('SELECT run, player_ids FROM snapshots ORDER BY run').fetchall():
+            infobox_state.executemany('INSERT OR REPLACE INTO snapshot_players VALUES (?, ?)',
+                                      [(player_id, run) for player_id in player_ids.split('\n')])
+
+
+# a snapshot row as (run, taken, {player id: {field: value}})
+def read_snapshot(row):
+    run, taken, player_ids, *stars, details = row
+    columns = [[value / 10 for value in array('H', column)] for column in stars]
+    columns += zip(*json.loads(zlib.decompress(details)))
+    fields = SNAPSHOT_STARS + SNAPSHOT_DETAILS
+    return (run, taken, {player_id: dict(zip(fields, values))
+                         for player_id, values in zip(player_ids.split('\n'), zip(*columns))})
+
+
+# every snapshot, oldest first
+def get_snapshots():
+    if infobox_state is None:
+        return
+    with infobox_state_lock:
+        rows = infobox_state.execute('SELECT * FROM snapshots ORDER BY run').fetchall()
+    for row in rows:
+        yield read_snapshot(row)
+
+
+# the latest snapshot of each of these players, from whichever run last fetched them.
+# only the runs that have one of them as their latest get unpacked
+def get_last_snapshot(player_ids):
+    if infobox_state is None:
+        return {}
+    wanted = set(player_ids)
+    with infobox_state_lock:
+        last_runs = infobox_state.execute('SELECT player_id, run FROM snapshot_players').fetchall()
+    runs = {}
+    for player_id, run in last_runs:
+        if player_id in wanted:
+            runs.setdefault(run, set()).add(player_id)
+    found = {}
+    for run, run_player_ids in runs.items():
+        with infobox_state_lock:
+            row = infobox_state.execute('SELECT * FROM snapshots WHERE run = ?', (run,)).fetchone()
+        found.update((player_id, values) for player_id, values in read_snapshot(row)[2].items()
+                     if player_id in run_player_ids)
+    return found
+
+
+# {player id: [(field, before, now)]} for every player whose snapshot fields moved since the last one
+def diff_snapshot(last_snapshot, players):
+    changes = {}
+    for player in players:
+        if player.id not in last_snapshot:
+            continue
+        before = last_snapshot[player.id]
+        now = {name: round(getattr(player, f'{name}_stars') * 10) / 10 for name in SNAPSHOT_STARS}
+        now.update(zip(SNAPSHOT_DETAILS, get_snapshot_details(player)))
+        fields = [(field, before[field], now[field]) for field in now if before[field] != now[field]]
+        if fields:
+            changes[player.id] = fields
+    return changes
+
+
+# --history: a wikitext page of every star change in the stored snapshots, worked out offline
+def write_history(filename):
+    history = {}
+    names = {}
+    for run, taken, snapshot in get_snapshots():
+        date = time.strftime('%Y-%m-%d %H:%M', time.gmtime(taken))
+        for player_id, values in snapshot.items():
+            stars = tuple(values[name] for name in SNAPSHOT_STARS)
+            rows = history.setdefault(player_id, [])
+            if not rows or rows[-1][1] != stars:
+                rows.append((date, stars))
+            names[player_id] = values['name']
+    with open(filename, 'w', encoding='utf-8') as f:
+        for player_id, rows in sorted(history.items(), key=lambda item: names[item[0]]):
+            if len(rows) < 2:
+                continue
+            f.write(f'== [[{names[player_id]}]] ==\n{{| class="wikitable sortable"\n! Date !! '
+                    + ' !! '.join(name.capitalize() for name in SNAPSHOT_STARS) + '\n')
+            for date, stars in rows:
+                f.write(f'|-\n| {date} || ' + ' || '.join(str(value) for value in stars) + '\n')
+            f.write('|}\n\n')
+    print(f'Wrote star history for {sum(len(rows) > 1 for rows in history.values())} players to {filename}')
+
+
+# API error codes that can go away if the same edit is sent again
+RETRYABLE_API_CODES = {'readonly', 'badtoken', 'ratelimited', 'maxlag'}
+
+
+# a synchronous put turns every pywikibot error into OtherPageSaveError, so look at what it wraps:
+# server trouble and timeouts are worth another go, the other page save errors are not.
+# anything pywikibot didn't wrap (dropped connections and the like) is retried too
+def is_retryable(err):
+    if isinstance(err, OtherPageSaveError):
+        err = err.reason
+        if isinstance(err, api.APIError):
+            return err.code in RETRYABLE_API_CODES or err.code.startswith('internal_api_error')
+        return isinstance(err, (ServerError, PwbTimeoutError)) and not isinstance(err, FatalServerError)
+    return not isinstance(err, PageSaveRelatedError)
+
+
+def run_saves():
+    while True:
+        job = save_queue.get()
+        if job is None:
+            save_queue.task_done()
+            return
+        page, text, summary, saved_message, failed_message, fingerprint = job
+
+        start = time.perf_counter()
+        err = None
+        for attempt in range(SAVE_RETRIES):
+            try:
+                page.put(text, summary=summary)
+                err = None
+                break
+            except Exception as e:
+                err = e
+                if not is_retryable(e):  # edit conflicts, protection, blacklists: trying again won't help
+                    break
+                if attempt + 1 < SAVE_RETRIES:
+                    save_stats['retries'] += 1
+                    print(f'Retrying save of {page.title()} ({e})')
+        save_latencies.append(time.perf_counter() - start)
+
+        if err is None:
+            save_stats['saved'] += 1
+            if saved_message:
+                print(saved_message)
+            if fingerprint is not None:  # remember what got saved once it has actually been saved
+                store_fingerprint(*fingerprint, page)
+        else:
+            save_stats['failed'] += 1
+            print(f'{failed_message} ({err})')
+        save_queue.task_done()
+
+
+# hand a save to the worker. blocks while the queue is full. fingerprint is the
+# (player id, fingerprint) to store once the save goes through. in --review mode
+# the save is written down for review_plan instead
+def queue_save(page, text, summary, saved_message, failed_message, fingerprint=None):
+    global save_worker
+    if review_plan is not None:
+        review_plan.append({'title': page.title(), 'summary': summary,
+                            'revid': page.latest_revision_id if page.exists() else None,
+                            'old_text': page.get() if page.exists() else '', 'text': text,
+                            'saved_message': saved_message, 'failed_message': failed_message,
+                            'fingerprint': fingerprint})
+        return
+    if save_worker is None:
+        save_stats['started'] = time.perf_counter()
+        save_worker = threading.Thread(target=run_saves, daemon=True)
+        save_worker.start()
+    save_queue.put((page, text, summary, saved_message, failed_message, fingerprint))
+
+
+# wait for every queued save to finish. returns (saved, failed)
+def finish_saves():
+    global save_worker
+    if save_worker is not None:
+        save_queue.put(None)
+        save_worker.join()
+        save_worker = None
+        save_stats['finished'] = time.perf_counter()
+    return (save_stats['saved'], save_stats['failed'])
+
+
+def print_save_report():
+    if not save_latencies:
+        return
+    minutes = (save_stats['finished'] - save_stats['started']) / 60
+    print(f'Saves: {save_stats["saved"]} saved, {save_stats["failed"]} failed, {save_stats["retries"]} retries, '
+          f'{save_stats["saved"] / minutes if minutes else 0:.1f} saves/minute')
+    print(f'Save latency: {sum(save_latencies) / len(save_latencies):.2f}s average, {max(save_latencies):.2f}s max')
+
+
+# --review: the plan as json for --apply, and a numbered text report of every diff next to it
+def write_review(filename, roster, snapshot):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump({'roster': roster, 'snapshot': snapshot, 'changes': review_plan}, f)
+    report_file = os.path.splitext(filename)[0] + '.txt'
+    with open(report_file, 'w', encoding='utf-8') as f:
+        for number, change in enumerate(review_plan, 1):
+            f.write(f'[{number}] {change["title"]}: {change["summary"]}\n')
+            f.writelines(difflib.unified_diff(change['old_text'].splitlines(True), change['text'].splitlines(True),
+                                              'current', 'proposed'))
+            f.write('\n\n')
+    print(f'Wrote {len(review_plan)} changes to {report_file} for review. Apply them with '
+          f'--apply --review_file {filename} [--approve 1,3,5-9]')
+
+
+# which change numbers --approve picked, e.g. 'all' (None) or '1,3,5-9'
+def parse_approve(approve):
+    if approve == 'all':
+        return None
+    approved = set()
+    for part in approve.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not first.isdigit() or (dash and not last.isdigit()) or int(first) < 1 or int(last or first) < int(first):
+            raise click.BadParameter(f'{part!r} is not a change number or a range like 5-9', param_hint='--approve')
+        approved.update(range(int(first), int(last or first) + 1))
+    return approved
+
+
+# the same, as a set of numbers that are actually in a plan of count changes
+def get_approved(approve, count):
+    approved = parse_approve(approve)
+    if approved is None:
+        return set(range(1, count + 1))
+    beyond = sorted(number for number in approved if number > count)
+    if beyond:
+        print(f'The review only has {count} changes, ignoring --approve numbers past that ({beyond[0]}'
+              + (f' to {beyond[-1]})' if len(beyond) > 1 else ')'))
+    return approved - set(beyond)
+
+
+# --apply: save the approved changes from a --review plan, skipping any page that has been
+# edited (or created) since the review, since the diff that was approved no longer applies.
+# returns (skipped, roster, snapshot)
+def apply_review(site, filename, approve):
+    with open(filename, encoding='utf-8') as f:
+        plan = json.load(f)
+    changes = plan['changes']
+    approved_numbers = get_approved(approve, len(changes))
+    approved = [change for number, change in enumerate(changes, 1) if number in approved_numbers]
+    revids = get_latest_revids(site, [change['title'] for change in approved])
+    skipped = 0
+    for change in approved:
+        if revids.get(change['title']) != change['revid']:
+            print(f'{change["title"]} changed since the review, skipping it')
+            skipped += 1
+            continue
+        queue_save(pwb.Page(site, change['title']), change['text'], change['summary'],
+                   change['saved_message'], change['failed_message'],
+                   tuple(change['fingerprint']) if change['fingerprint'] else None)
+    print(f'Applying {len(approved) - skipped} of {len(changes)} reviewed changes')
+    return (skipped, plan['roster'], plan.get('snapshot'))
+
+
 # i am tired of dealing with york's antics
 def get_item_name(bat):
     if bat.name == 'Vibe Check':
@@ -19,79 +565,181 @@ def get_item_name(bat):
         return bat.name
 
 
+# star ratings get compared and written in one canonical form, so '3', '3.0' and ' 3.00 ' on the
+# wiki all count as the same 3 stars as the API's 3.0 and don't get rewritten. None if it isn't a number
+def normalize_stars(value):
+    try:
+        return round(float(str(value).strip(WS)), 1)
+    except ValueError:
+        return None
+
+
+def format_stars(stars):
+    return f'{{{{Star Rating|{normalize_stars(stars)}}}}}'
+
+
+# get the stars from an infobox value, or None if it can't figure it out
+def get_wiki_stars(value):
+    if not value:
+        return None
+    match = star_rating_re.fullmatch(value.strip(WS))
+    if match:  # the usual {{Star Rating|x}}, no need to parse it
+        return normalize_stars(match.group(1))
+    value_templates = wtp.parse(value).templates  # if values contain a template, this will grab them
+    if len(value_templates) > 0 and len(value_templates[0].arguments) > 0:
+        return normalize_stars(value_templates[0].arguments[0].value)
+    return None
+
+
+def get_modifications(player):
+    armor = [f'{{{{Modif|{player.armor.name.lower()}}}}}'] if player.armor.name != 'None' else []
+    bat = [f'{{{{Modif|{player.bat.name.lower()}}}}}'] if player.bat.name != 'None' else []
+    playermods = player.perm_attr + player.seas_attr  # anything shorter and i don't care
+    print(player.perm_attr)
+    mod_text = [f'{{{{Modif|{element.title.lower()}}}}}' for idx, element in enumerate(playermods)]
+    return '<br />'.join(mod_text + armor + bat)
+
+
+# the (name, value) pairs to set on the infobox, in order. get_value(name) is the
+# current value of that argument, or None if the infobox doesn't have it
+def get_infobox_edits(player, get_value):
+    edits = []
+    for name, value in [('batting', player.batting_stars), ('pitching', player.pitching_stars),
+                        ('baserunning', player.baserunning_stars), ('defense', player.defense_stars)]:
+        if get_wiki_stars(get_value(name)) != normalize_stars(value):
+            edits.append((name, format_stars(value)))
+    fields = [#('modifications', get_modifications(player)),
+              ('blood', player.blood),
+              ('coffee', player.coffee),
+              ('ritual', player.ritual),
+              ('fate', str(player.fate)),
+              ('soulscream', player.soulscream),
+              ('uuid', player.id),
+              ('armor', player.armor.name),
+              ('item', get_item_name(player.bat))]
+    edits += [(name, value) for name, value in fields if value]
+    return edits
+
+
+# the new value for an argument, keeping the whitespace around the old one like set_arg's preserve_spacing.
+# an empty value gets filled in after any leading spaces: set_arg would do ''.replace('', value) and put
+# value around every character
+def fill_value(old_value, value):
+    stripped = old_value.strip(WS)
+    if stripped:
+        return old_value.replace(stripped, value)
+    leading = len(old_value) - len(old_value.lstrip(' \t'))
+    return old_value[:leading] + value + old_value[leading:]
+
+
 def process_infobox(player, templates):
     true_template = [template for template in templates if template.normal_name() in 'Player'][0]
 
-    def set_template(name, value):
-        if value:
-            true_template.set_arg(name, value, preserve_spacing=True)
+    def get_value(name):
+        arg = true_template.get_arg(name)
+        return arg.value if arg else None
 
-    # get the stars from the template, or -1 if it can't figure it out
-    def set_wiki_stars(name, value):
-        wiki_stars = -1
-        value_templates = []
+    for name, value in get_infobox_edits(player, get_value):
         arg = true_template.get_arg(name)
-        if arg and arg.value:
-            value_templates = wtp.parse(arg.value).templates  # if values contain a template, this will grab them
-        if len(value_templates) > 0 and len(value_templates[0].arguments) > 0:
-            wiki_stars = value_templates[0].arguments[0].value
-        if isinstance(wiki_stars, int) or wiki_stars.isnumeric():
-            wiki_stars = float(wiki_stars)
-        if wiki_stars != value:
-            true_template.set_arg(name, f'{{{{Star Rating|{value}}}}}', preserve_spacing=True)
-
-    def set_modifications():
-        armor = [f'{{{{Modif|{player.armor.name.lower()}}}}}'] if player.armor.name != 'None' else []
-        bat = [f'{{{{Modif|{player.bat.name.lower()}}}}}'] if player.bat.name != 'None' else []
-        playermods = player.perm_attr + player.seas_attr  # anything shorter and i don't care
-        print(player.perm_attr)
-        mod_text = [f'{{{{Modif|{element.title.lower()}}}}}' for idx, element in enumerate(playermods)]
-        mod_text = '<br />'.join(mod_text + armor + bat)
-        set_template('modifications', mod_text)
-
-    #set_modifications()
-    set_wiki_stars('batting', player.batting_stars)
-    set_wiki_stars('pitching', player.pitching_stars)
-    set_wiki_stars('baserunning', player.baserunning_stars)
-    set_wiki_stars('defense', player.defense_stars)
-    set_template('blood', player.blood)
-    set_template('coffee', player.coffee)
-    set_template('ritual', player.ritual)
-    set_template('fate', str(player.fate))
-    set_template('soulscream', player.soulscream)
-    set_template('uuid', player.id)
-    set_template('armor', player.armor.name)
-    set_template('item', get_item_name(player.bat))
+        if arg:
+            arg.value = fill_value(arg.value, value)
+        else:
+            true_template.set_arg(name, value, preserve_spacing=True)
 
     return templates
 
 
-def add_uuid(player, site, always, error_count, page_count):
-    page = pwb.Page(site, player.id)
-    if page.exists() is True:
-        return (page_count, error_count, always)
+# find the first {{Player}} template without parsing the whole page. returns its (start, end)
+# in text and {name: (start, end)} of each named argument's value, relative to start. None if
+# the template can't be picked out safely, in which case the caller should parse the page
+def find_infobox(text):
+    if '<nowiki' in text or '<pre' in text:
+        return None
+    for match in infobox_start_re.finditer(text):
+        comment_start = text.rfind('<!--', 0, match.start())
+        if comment_start == -1 or text.find('-->', comment_start, match.start()) != -1:
+            break
     else:
-        while True:
-            result = page.put(f'#REDIRECT [[{player.name}]]', summary='Create UUID redirect', asynchronous=True)
-            if result is None:
-                print(f'Added UUID redirect for {player.name}.')
-                return (page_count + 1, error_count, always)
-            else:
-                print(f'Error occurred while saving UUID redirect! Try {player.name} again.')
-                return (page_count, error_count + 1, always)
+        return None
 
+    start = match.start()
+    braces, links = 0, 0
+    args = {}
+    arg_start, equals = None, None
+    for token in infobox_token_re.finditer(text, start):
+        kind = token.group()
+        if kind.startswith('<!--'):
+            if not kind.endswith('-->'):
+                return None
+            continue
+        at_top = braces == 1 and links == 0
+        if at_top and kind == '=' and arg_start is not None and equals is None:
+            equals = token.start()
+            continue
+        if at_top and (kind == '|' or kind == '}}'):
+            if equals is not None:  # named arguments only, positional ones are never touched
+                name = text[arg_start:equals].strip(WS)
+                args[name] = (equals + 1 - start, token.start() - start)
+            arg_start, equals = token.end(), None
+        if kind == '{{':
+            braces += 1
+        elif kind == '}}':
+            braces -= 1
+            if braces == 0:
+                if html_tag_re.search(text, start, token.end()):
+                    return None
+                return (start, token.end(), args)
+        elif kind == '[[':
+            links += 1
+        elif kind == ']]' and links > 0:
+            links -= 1
+    return None  # never closed
 
-def add_new(player, site, always, error_count, page_count, team_name, role, is_shadowed):
-    page = pwb.Page(site, player.name.replace(' ', '_'))
 
-    name_split = player.name.split()
-    name_split.pop(0)
-    last_name = ' '.join(name_split)
+# process_infobox for a whole page's text: only the argument values that change are touched,
+# and only a malformed page gets the full parse
+def patch_infobox(player, text):
+    found = find_infobox(text)
+    if found is None:
+        wtppage = wtp.parse(text)
+        process_infobox(player, [element for idx, element in enumerate(wtppage.templates) if 'Player' in element.name])
+        return wtppage.string
+    start, end, args = found
+    template = text[start:end]
 
-    new_category = 'Shadows' if is_shadowed else f'{role}s'
-    header = 'Shadows' if is_shadowed else 'New_Player_Header'
+    def get_value(name):
+        return template[slice(*args[name])] if name in args else None
 
-    text = f"""
+    edits = get_infobox_edits(player, get_value)
+    # splice from the end backwards so earlier offsets stay put
+    for name, value in sorted([edit for edit in edits if edit[0] in args], key=lambda edit: args[edit[0]], reverse=True):
+        value_start, value_end = args[name]
+        old_value = template[value_start:value_end]
+        template = template[:value_start] + fill_value(old_value, value) + template[value_end:]
+    missing = [edit for edit in edits if edit[0] not in args]
+    if missing:  # adding an argument means matching the template's spacing, leave that to wikitextparser
+        true_template = wtp.Template(template)
+        for name, value in missing:
+            true_template.set_arg(name, value, preserve_spacing=True)
+        template = true_template.string
+    return text[:start] + template + text[end:]
+
+
+def add_uuid(player, site, always, error_count, page_count):
+    page = get_page(site, player.id)
+    if page.exists() is True:
+        return (page_count, error_count, always)
+    else:
+        # counted in page_count/error_count once the save queue has finished
+        queue_save(page, f'#REDIRECT [[{player.name}]]', 'Create UUID redirect',
+                   f'Added UUID redirect for {player.name}.',
+                   f'Error occurred while saving UUID redirect! Try {player.name} again.')
+        return (page_count, error_count, always)
+
+
+# the page add_new creates. {slots} get filled in by render_new_page, with the infobox
+# fields already in the form process_infobox would have given them
+NEW_PAGE_SKELETON = """
 {{{{Template:{header}}}}} <!-- Remove this header and comment when adding community lore for the first time -->
 {{{{Player
 | title1={{{{{{PAGENAME}}}}}}
@@ -108,24 +756,23 @@ def add_new(player, site, always, error_count, page_count, team_name, role, is_s
 | dates= <!-- IRL dates active (ex. Jul 20 - Aug 31, 2020) -->
 <!-- Records: Statistical Information -->
 <!-- These are star ratings -->
-| batting={{{{Star Rating|{player.batting_stars}}}}}
-| pitching={{{{Star Rating|{player.pitching_stars}}}}}
-| baserunning={{{{Star Rating|{player.baserunning_stars}}}}}
-| defense={{{{Star Rating|{player.defense_stars}}}}}
+| batting={batting}
+| pitching={pitching}
+| baserunning={baserunning}
+| defense={defense}
 | modification=
 <!-- These are taken from the pop-up box on clicking the player -->
-| item=
-| armor=
+| item={item}
+| armor={armor}
 | evolution=
-| ritual={player.ritual}
-| coffee={player.coffee.text}
-| blood={player.blood.text}
-| fate={str(player.fate)}
-| soulscream={player.soulscream}
-| uuid={player.id}
-<!-- For community lore info box fields, see Template:Player/doc & delete this note. -->
+| ritual={ritual}
+| coffee={coffee}
+| blood={blood}
+| fate={fate}
+| soulscream={soulscream}
+| uuid={uuid}
 }}}}
-'''{{{{PAGENAME}}}}''' is a {role} for the [[{team_name}]]{' in the [[Shadows]].' if is_shadowed else ', and has been with the team since [[Season]], Day #.'}
+'''{{{{PAGENAME}}}}''' is a {role} for the [[{team_name}]]{joined}
 
 <!--
 == Official League Records ==
@@ -138,7 +785,7 @@ def add_new(player, site, always, error_count, page_count, team_name, role, is_s
 ----
 <references />
 {{{{TeamNavSelector|{team_name}}}}}
-{{{{TeamCategorySelector|{team_name}}}}}
+{category_selector}
 <br />
 <!-- Add categories as needed. You might want:
 [[Category:Players who Replaced an Incinerated Player]]
@@ -146,12 +793,54 @@ def add_new(player, site, always, error_count, page_count, team_name, role, is_s
 [[Category:Players]]
 [[Category:{new_category}]]
     """
+# the skeleton split up once into (text, slot) pieces, so a page is rendered in a single join
+new_page_parts = [(literal, slot) for literal, slot, spec, conversion in string.Formatter().parse(NEW_PAGE_SKELETON)]
+
+
+def render_new_page(slots):
+    return ''.join(literal + slots[slot] if slot is not None else literal for literal, slot in new_page_parts)
+
 
-    wtppage = wtp.parse(text)
-    infobox = [element for idx, element in enumerate(wtppage.templates) if 'Player' in element.name]
-    infobox = process_infobox(player, infobox)
+# the full name of the player's current team, from the team registry rather than loading the team
+def get_player_team_name(player):
+    team_id = getattr(player, '_league_team_id', None)
+    team = teams.get_team(team_id) if team_id else None
+    return team.full_name if team is not None else None
 
-    newtext = wtppage.string
+
+def get_category_selector(team_name):
+    team = teams.get_team(team_name) if team_name else None
+    return team.category_selector if team is not None else f'{{{{TeamCategorySelector|{team_name}}}}}'
+
+
+def add_new(player, site, always, error_count, page_count, team_name, role, is_shadowed):
+    page = get_page(site, player.name.replace(' ', '_'))
+
+    name_split = player.name.split()
+    name_split.pop(0)
+    last_name = ' '.join(name_split)
+
+    text = render_new_page({
+        'header': 'Shadows' if is_shadowed else 'New_Player_Header',
+        'team_name': str(team_name),
+        'category_selector': get_category_selector(team_name),
+        'batting': format_stars(player.batting_stars),
+        'pitching': format_stars(player.pitching_stars),
+        'baserunning': format_stars(player.baserunning_stars),
+        'defense': format_stars(player.defense_stars),
+        'item': get_item_name(player.bat) or '',
+        'armor': player.armor.name or '',
+        'ritual': str(player.ritual),
+        'coffee': str(player.coffee),
+        'blood': str(player.blood),
+        'fate': str(player.fate),
+        'soulscream': str(player.soulscream),
+        'uuid': player.id,
+        'role': str(role),
+        'joined': ' in the [[Shadows]].' if is_shadowed else ', and has been with the team since [[Season]], Day #.',
+        'last_name': last_name,
+        'new_category': 'Shadows' if is_shadowed else f'{role}s',
+    })
 
     while True:
         # Let's put the changes.
@@ -172,35 +861,29 @@ def add_new(player, site, always, error_count, page_count, team_name, role, is_s
                 pwb.bot.open_webbrowser(page)
 
         if always or choice == 'y':
-            result = page.put(newtext, summary=f'Create \'{player.name}\' page', asynchronous=True)
-
-            if result is None:
-                print(f'Created player page for {player.name}.')
-                return (page_count + 1, error_count, always)
-            else:
-                print(f'Error occurred while creating player page! Try {player.name} again.')
-                return (page_count, error_count + 1, always)
+            queue_save(page, text, f'Create \'{player.name}\' page',
+                       f'Created player page for {player.name}.',
+                       f'Error occurred while creating player page! Try {player.name} again.',
+                       (player.id, get_fingerprint(player)))
+            return (page_count, error_count, always)
 
 
 def edit_existing(player, site, always, error_count, page_count):
     # Find the infobox??
-    page = pwb.Page(site, player.name.replace(' ', '_'))
-
-    pwbpage = page.get()
-    wtppage = wtp.parse(page.get())
-    infobox = [element for idx, element in enumerate(wtppage.templates) if 'Player' in element.name]
-    infobox = process_infobox(player, infobox)
+    page = get_page(site, player.name.replace(' ', '_'))
 
-    newtext = wtppage.string
-    text = pwbpage
+    text = page.get()
+    newtext = patch_infobox(player, text)
 
     if text == newtext:
         print(f'skipping {player.name}')
+        store_fingerprint(player.id, get_fingerprint(player), page)
         return (page_count, error_count, always)
     else:
-        pwb.output(color_format(
-            '\n\n>>> {lightpurple}{0}{default} <<<', page.title()))
-        pwb.showDiff(text, newtext)
+        if review_plan is None:  # --review puts the diff in its report instead
+            pwb.output(color_format(
+                '\n\n>>> {lightpurple}{0}{default} <<<', page.title()))
+            pwb.showDiff(text, newtext)
 
         while True:
             # Let's put the changes.
@@ -221,12 +904,10 @@ def edit_existing(player, site, always, error_count, page_count):
                     pwb.bot.open_webbrowser(page)
 
             if always or choice == 'y':
-                result = page.put(newtext, summary='Update player infobox', asynchronous=True)
-                if result is None:
-                    return (page_count + 1, error_count, always)
-                else:
-                    print(f'Error occurred! Try {player.name} again.')
-                    return (page_count, error_count + 1, always)
+                queue_save(page, newtext, 'Update player infobox', None,
+                           f'Error occurred! Try {player.name} again.',
+                           (player.id, get_fingerprint(player)))
+                return (page_count, error_count, always)
 
 
 # for each player...
@@ -234,7 +915,7 @@ def wiki_edit(player, site, always, error_count, page_count, team_name, role, is
     # create the UUID redirect
     (page_count, error_count, always) = add_uuid(player, site, always, error_count, page_count)
 
-    page = pwb.Page(site, player.name.replace(' ', '_'))
+    page = get_page(site, player.name.replace(' ', '_'))
 
     if (page.exists() is not True):
         # create the player page
@@ -249,39 +930,115 @@ def wiki_edit(player, site, always, error_count, page_count, team_name, role, is
 @click.command()
 @click.option('--player_id', help='Player UUID')
 @click.option('--player_ids', help='Player UUIDs...')
-def main(player_id, player_ids):
+@click.option('--state_file', default=INFOBOX_STATE_FILE, show_default=True,
+              help='Where to remember what was last written for each player')
+@click.option('--no_state', is_flag=True, help='Check every player\'s page, even if nothing changed since the last run')
+@click.option('--roster_diff', is_flag=True,
+              help='Only touch players who were added, moved or changed since the last league-wide run')
+@click.option('--review', is_flag=True, help='Work out every change without asking or saving, and write them up for review')
+@click.option('--apply', 'apply_', is_flag=True, help='Save the approved changes from an earlier --review')
+@click.option('--review_file', default=REVIEW_FILE, show_default=True,
+              help='Where --review writes its plan (the report goes next to it as .txt), and --apply reads it')
+@click.option('--approve', default='all', show_default=True, help='With --apply, which changes to save, e.g. 1,3,5-9')
+@click.option('--history', help='Write a page of every player\'s star changes from the stored snapshots to this file, '
+                                'without touching the API or the wiki')
+def main(player_id, player_ids, state_file, no_state, roster_diff, review, apply_, review_file, approve, history):
+    global review_plan
+    if history:
+        open_infobox_state(state_file)
+        write_history(history)
+        return
+    if roster_diff and no_state:
+        raise click.UsageError('--roster_diff needs the state file to compare against')
+    if review and apply_:
+        raise click.UsageError('--review and --apply are separate runs')
+    if apply_:
+        parse_approve(approve)  # a typo should stop the run before it logs in
     site = pwb.Site()
+    if not no_state:
+        open_infobox_state(state_file)
     always = False
     error_count = 0
     page_count = 0
+    roster = None  # the league roster, when this is a league-wide run
+    snapshot = None  # the players this run fetched, for store_snapshot
+    if review:
+        review_plan = []
+        always = True  # nothing gets saved without going through --apply anyway
 
-    if (player_id):
-        player = Player.load_one(player_id)  # Load player from blaseball-mike
-        (page_count, error_count, always) = wiki_edit(player, site, always, error_count, page_count, None, None, False)
+    finished = False
+    try:
+        if apply_:
+            (skipped, roster, snapshot) = apply_review(site, review_file, approve)
+            error_count += skipped
 
-    elif (player_ids):
-        ids_list = player_ids.split(',')
-        for player_id in ids_list:
+        elif (player_id):
             player = Player.load_one(player_id)  # Load player from blaseball-mike
-            (page_count, error_count, always) = wiki_edit(player, site, always, error_count, page_count, None, None, False)
-    else:
-        teams = Team.load_all()
+            (page_count, error_count, always) = wiki_edit(player, site, always, error_count, page_count,
+                                                          get_player_team_name(player), None, False)
+
+        else:
+            # work out everyone we're going to touch first: (player id, team name, role, is shadowed)
+            sweep = []
+            if (player_ids):
+                ids_list = player_ids.split(',')
+                for player_id in ids_list:
+                    sweep.append((player_id, None, None, False))
+            else:
+                league_teams = Team.load_all()
+                roster = get_league_roster(league_teams)
+                stored_roster = get_stored_roster()
+                for player_id, (team_name, role, is_shadowed) in roster.items():
+                    sweep.append((player_id, team_name, role, is_shadowed))
+
+            # Load players from blaseball-mike
+            players = load_players([player_id for player_id, team_name, role, is_shadowed in sweep])
+            loaded_sweep = []
+            for player, (player_id, team_name, role, is_shadowed) in zip(players, sweep):
+                if player is None:
+                    print(f'Could not load player {player_id}')
+                    error_count += 1
+                else:
+                    loaded_sweep.append((player, team_name or get_player_team_name(player), role, is_shadowed))
+            loaded = [player for player, team_name, role, is_shadowed in loaded_sweep]
+            load_player_details(loaded)
+            snapshot_changes = diff_snapshot(get_last_snapshot([player.id for player in loaded]), loaded)
+            snapshot = make_snapshot(loaded)
+            if not review:
+                store_snapshot(snapshot)
+            if roster is not None and roster_diff:
+                sweep = diff_roster(loaded_sweep, stored_roster, snapshot_changes)
+            else:
+                sweep = skip_unchanged(site, loaded_sweep)
 
-        for team in teams.values():
-            if team.nickname == 'Shoe Thieves':
-                for batter in team.lineup:
-                    (page_count, error_count, always) = wiki_edit(batter, site, always, error_count, page_count, team.full_name, 'Batter', False)
+            preload_pages(site, [player for player, team_name, role, is_shadowed in sweep])
 
-                for pitcher in team.rotation:
-                    (page_count, error_count, always) = wiki_edit(pitcher, site, always, error_count, page_count, team.full_name, 'Pitcher', False)
+            for (player, team_name, role, is_shadowed) in sweep:
+                (page_count, error_count, always) = wiki_edit(player, site, always, error_count, page_count, team_name, role, is_shadowed)
+        finished = True
+    finally:
+        # the save worker is a daemon thread, so drain it even after a quit, Ctrl-C or a crash
+        (saved, failed) = finish_saves()
+        if not finished:
+            print(f'Stopped early. Saved {page_count + saved} pages. Error count: {error_count + failed}.')
 
-                # for batter in team.bench:
-                #     (page_count, error_count, always) = wiki_edit(batter, site, always, error_count, page_count, team.full_name, 'Batter', True)
+    if review:
+        # the roster and the player snapshot wait for --apply, so a diff run before then still sees the same changes
+        write_review(review_file, roster, snapshot)
+        if error_count:
+            print(f'Error count: {error_count}.')
+        return
 
-                # for pitcher in team.bullpen:
-                #     (page_count, error_count, always) = wiki_edit(pitcher, site, always, error_count, page_count, team.full_name, 'Pitcher', True)
+    page_count += saved
+    error_count += failed
+    # anyone who didn't make it onto the wiki this time has no fingerprint, so the next diff still picks them up
+    if roster is not None:
+        store_roster(roster)
+    if apply_:
+        store_snapshot(snapshot)
 
     print(f'Updated {page_count} pages. Error count: {error_count}.')
+    print_save_report()
 
 
 # To victory
@@ -1,33 +1,15 @@
-from blaseball_mike.models import Team
+from blaseball_mike.models import Team, Player
 import click
 import pywikibot as pwb
+import teams
 import wikitextparser as wtp
 
-# Turn a blaseball team id into the correct {{Template:}} call
-def id_to_nav(id):
-    switcher = {
-    "8d87c468-699a-47a8-b40d-cfb73a5660ad": "CrabsNav",
-    "3f8bbb15-61c0-4e3f-8e4a-907a5fb1565e": "FlowersNav",
-    "a37f9158-7f82-46bc-908c-c9e2dda7c33b": "JazzHandsNav",
-    "eb67ae5e-c4bf-46ca-bbbc-425cd34182ff": "MoistTalkersNav",
-    "bfd38797-8404-4b38-8b82-341da28b1f83": "ShoeThievesNav",
-    "ca3f1c8c-c025-4d8e-8eef-5be6accbeb16": "FirefightersNav",
-    "b024e975-1c4a-4575-8936-a3754a08806a": "SteaksNav",
-    "747b8e4a-7e50-4638-a973-ea7950a3e739": "TigersNav",
-    "979aee4a-6d80-4863-bf1c-ee1a78e06024": "FridaysNav",
-    "f02aeae2-5e6a-4098-9842-02d2273f25c7": "SunbeamsNav",
-    "9debc64f-74b7-4ae1-a4d6-fce0144b6ea5": "SpiesNav",
-    "adc5b394-8f76-416d-9ce9-813706877b84": "BreathMintsNav",
-    "57ec08cc-0411-4643-b304-0e80dbc15ac7": "WildWingsNav",
-    "b63be8c2-576a-4d6e-8daf-814f8bcea96f": "DaléNav",
-    "36569151-a2fb-43c1-9df7-2df512424c82": "MillennialsNav",
-    "23e4cbc1-e9cd-47fa-a35b-bfa06f726cb7": "PiesNav",
-    "b72f3061-f573-40d7-832a-5ad475bd7909": "LoversNav",
-    "105bc3ff-1320-4e37-8ef0-8d595cb95dd0": "GaragesNav",
-    "878c1bf6-0d21-4659-bfee-916c8314d69c": "TacosNav",
-    "7966eb04-efcc-499b-8f03-d13916330531": "MagicNav"
-    }
-    return switcher.get(id, "None")
+# How many players to ask the API for at once in --all_teams mode
+PLAYER_CHUNK = 50
+
+# Turn a list of player names into the navbox's wikitext
+def linkify(names):
+    return '[[' + ']] · [['.join(names) + ']]'
 
 def textify(team, roster):
     # Create a list of players from team
@@ -39,11 +21,11 @@ def textify(team, roster):
 
     # Output the roster in wikitext format
     if roster == "lineup":
-        output_list = '[[' + ']] · [['.join(lineup_list) + ']]'
+        output_list = linkify(lineup_list)
         return output_list
 
     elif roster == "rotation":
-        output_list = '[[' + ']] · [['.join(rotation_list) + ']]'
+        output_list = linkify(rotation_list)
         return output_list
 
     # elif roster == "bench":
@@ -57,37 +39,101 @@ def textify(team, roster):
     # elif roster == "full":
     # idk somehow do both
 
+# Find the list argument holding a roster: the listN next to the groupN labelled "Lineup" or "Rotation",
+# in whichever Navbox on the page has it. Navs without those labels fall back to where they used to be,
+# the Navbox child's 5th and 6th arguments
+def find_roster_arg(parsed, roster):
+    for template in parsed.templates:
+        if template.normal_name().lower() != 'navbox':
+            continue
+        for arg in template.arguments:
+            name = arg.name.strip()
+            if name.startswith('group') and arg.value.strip().lower() == roster:
+                list_arg = template.get_arg('list' + name[len('group'):])
+                if list_arg is not None:
+                    return list_arg
+    child = parsed.templates[0].arguments[9].templates[0]
+    return child.arguments[{"lineup": 4, "rotation": 5}[roster]]
+
+# Put the new roster text into a nav page's wikitext, e.g. {"lineup": textified}. Only the lists
+# themselves are touched, keeping the whitespace around them, and a roster that's already
+# right is left alone so the page comes back unchanged
+def update_nav(page_text, rosters):
+    parsed = wtp.parse(page_text)
+    for roster, textified in rosters.items():
+        arg = find_roster_arg(parsed, roster)
+        value = arg.value
+        if value.strip() == textified:
+            continue
+        if value.strip():
+            arg.value = value[:len(value) - len(value.lstrip())] + textified + value[len(value.rstrip()):]
+        else:
+            arg.value = textified + value
+    return parsed.string
+
 def wiki_edit(nav, roster, textified):
     # Fetch the correct Template from the wiki
     site = pwb.Site()
     page = pwb.Page(site, f'Template:{nav}')
 
-    # Find the Navbox child
-    text = wtp.parse(page.get()).templates[0].arguments[9].value
+    # Post to wiki, if anything changed
+    new_text = update_nav(page.get(), {roster: textified})
+    if new_text != page.text:
+        page.put(new_text, summary="Automated reverb update")
 
-    # Find the correct string, replace, and post to wiki
-    if roster == 'lineup':
-        parsed = wtp.parse(text).templates[0].arguments[4].value
-        page.put(page.text.replace(f"{parsed}", f"{textified}"), summary="Automated reverb update")
-
-    elif roster == 'rotation':
-        parsed = wtp.parse(text).templates[0].arguments[5].value
-        page.put(page.text.replace(f"{parsed}", f"{textified}"), summary="Automated reverb update")
+# Update every team's nav in one pass: one Team.load_all, the players in a few bulk loads,
+# all the nav pages in one batch, and a save only for the navs that changed
+def update_all_navs(rosters):
+    site = pwb.Site()
+    nav_teams = [team for team in Team.load_all().values() if teams.get_nav(team.id) is not None]
+
+    # Load every rostered player's name
+    player_ids = [player_id for team in nav_teams for player_id in team._lineup_ids + team._rotation_ids]
+    names = {}
+    for start in range(0, len(player_ids), PLAYER_CHUNK):
+        names.update((player_id, player.name)
+                     for player_id, player in Player.load(*player_ids[start:start + PLAYER_CHUNK]).items())
+
+    # Fetch every nav at once
+    pages = [pwb.Page(site, f'Template:{teams.get_nav(team.id)}') for team in nav_teams]
+    for page in site.preloadpages(pages, groupsize=50):
+        pass
+
+    changed = 0
+    for team, page in zip(nav_teams, pages):
+        roster_ids = {"lineup": team._lineup_ids, "rotation": team._rotation_ids}
+        if any(player_id not in names for roster in rosters for player_id in roster_ids[roster]):
+            print(f'Could not load every player for {page.title()}, skipping it')
+            continue
+        new_text = update_nav(page.text, {roster: linkify([names[player_id] for player_id in roster_ids[roster]])
+                                          for roster in rosters})
+        if new_text != page.text:
+            page.put(new_text, summary="Automated reverb update")
+            changed += 1
+    print(f'Updated {changed} of {len(pages)} navs.')
 
 # Command line parsing
 @click.command()
-@click.option('--team', required=True, help="Team name")
-@click.option('--roster', required=True, help="Which roster portion to adjust (lineup, rotation, or full)")
-def main(team_name, roster):
+@click.option('--team', 'team_name', help="Team name")
+@click.option('--roster', help="Which roster portion to adjust (lineup, rotation, or full)")
+@click.option('--all_teams', is_flag=True, help="Update every team's nav in one pass (both rosters unless --roster is given)")
+def main(team_name, roster, all_teams):
     """Retrieves a given roster from the Blaseball API and parses it for writing to the team's Blasebal Wiki navigation box."""
 
-    team_name = team
-    # Load team from blaseball-mike
-    team_obj = Team.load_by_name(team_name)
+    if all_teams:
+        update_all_navs(["lineup", "rotation"] if roster in (None, "full") else [roster])
+        return
+    if not team_name or not roster:
+        raise click.UsageError("--team and --roster are needed unless --all_teams is given")
+
+    # Look the team up in the registry, then load it from blaseball-mike
+    team = teams.find_team(team_name)
+    if team is None or team.nav is None:
+        raise click.UsageError(f"Don't know a nav template for {team_name}")
+    team_obj = Team.load(team.id)
     change_level = roster
-    # Turn team.id into the correct wiki nav page
-    nav = id_to_nav(team_obj.id)
-    # if nav = None something something error?
+    # The correct wiki nav page
+    nav = team.nav
     # Wikitextify the team.lineup list for navbox use
     new_roster = textify(team_obj, change_level)
     # Edit the wiki using nav, --roster (change_level), and textify (new_roster)
@@ -0,0 +1,129 @@
+from blaseball_mike.models import Team
+from collections import namedtuple
+import json
+import os
+import threading
+
+# everything the wikiscripts need to know about a team. nav is the Template:<nav> navbox (None if
+# the team doesn't have one), category_selector what goes at the bottom of its players' pages
+TeamInfo = namedtuple('TeamInfo', ['id', 'full_name', 'nickname', 'aliases', 'nav', 'category_selector'])
+
+# team names barely ever change, so the API is only asked once and the answer kept here. a name or id
+# it doesn't have gets the API asked again, once per run, in case it's a new or renamed team
+TEAM_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'teams-cache.json')
+
+# what the wiki has for each ILB team, and names the feed uses that aren't a team's full name or nickname
+TEAM_WIKI = {
+    "8d87c468-699a-47a8-b40d-cfb73a5660ad": {'nav': "CrabsNav"},
+    "3f8bbb15-61c0-4e3f-8e4a-907a5fb1565e": {'nav': "FlowersNav"},
+    "a37f9158-7f82-46bc-908c-c9e2dda7c33b": {'nav': "JazzHandsNav"},
+    "eb67ae5e-c4bf-46ca-bbbc-425cd34182ff": {'nav': "MoistTalkersNav"},
+    "bfd38797-8404-4b38-8b82-341da28b1f83": {'nav': "ShoeThievesNav"},
+    "ca3f1c8c-c025-4d8e-8eef-5be6accbeb16": {'nav': "FirefightersNav"},
+    "b024e975-1c4a-4575-8936-a3754a08806a": {'nav': "SteaksNav"},
+    "747b8e4a-7e50-4638-a973-ea7950a3e739": {'nav': "TigersNav"},
+    "979aee4a-6d80-4863-bf1c-ee1a78e06024": {'nav': "FridaysNav"},
+    "f02aeae2-5e6a-4098-9842-02d2273f25c7": {'nav': "SunbeamsNav"},
+    "9debc64f-74b7-4ae1-a4d6-fce0144b6ea5": {'nav': "SpiesNav"},
+    "adc5b394-8f76-416d-9ce9-813706877b84": {'nav': "BreathMintsNav"},
+    "57ec08cc-0411-4643-b304-0e80dbc15ac7": {'nav': "WildWingsNav"},
+    "b63be8c2-576a-4d6e-8daf-814f8bcea96f": {'nav': "DaléNav", 'aliases': ['dalé', 'dale']},
+    "36569151-a2fb-43c1-9df7-2df512424c82": {'nav': "MillennialsNav"},
+    "23e4cbc1-e9cd-47fa-a35b-bfa06f726cb7": {'nav': "PiesNav", 'aliases': ['pies']},  # not the Spies
+    "b72f3061-f573-40d7-832a-5ad475bd7909": {'nav': "LoversNav"},
+    "105bc3ff-1320-4e37-8ef0-8d595cb95dd0": {'nav': "GaragesNav"},
+    "878c1bf6-0d21-4659-bfee-916c8314d69c": {'nav': "TacosNav"},
+    "7966eb04-efcc-499b-8f03-d13916330531": {'nav': "MagicNav"},
+}
+
+# every team keyed by id, lowercased full name, lowercased nickname and alias. load_teams fills it in
+team_index = None
+teams_in_order = []
+team_index_lock = threading.RLock()
+team_cache_fresh = False  # whether this run already got the list from the API
+
+
+def read_team_cache(offline):
+    if os.path.exists(TEAM_CACHE_FILE):
+        with open(TEAM_CACHE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    if offline:
+        raise LookupError(TEAM_CACHE_FILE)
+    return write_team_cache()
+
+
+def write_team_cache():
+    global team_cache_fresh
+    team_cache_fresh = True
+    rows = [[team_id, team.full_name, team.nickname] for team_id, team in Team.load_all().items()]
+    with open(TEAM_CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False, indent=0)
+    return rows
+
+
+# offline only uses the cache file and raises LookupError if there isn't one yet
+def load_teams(offline=False, refresh=False):
+    global team_index, teams_in_order
+    with team_index_lock:
+        if team_index is not None and not refresh:
+            return team_index
+        rows = write_team_cache() if refresh else read_team_cache(offline)
+        # ILB teams first, so they win any name they share with some other team
+        rows.sort(key=lambda row: row[0] not in TEAM_WIKI)
+        index = {}
+        teams_in_order = []
+        for team_id, full_name, nickname in rows:
+            wiki = TEAM_WIKI.get(team_id, {})
+            team = TeamInfo(team_id, full_name, nickname, wiki.get('aliases', []), wiki.get('nav'),
+                            f'{{{{TeamCategorySelector|{full_name}}}}}')
+            teams_in_order.append(team)
+            for key in [team_id, full_name.lower(), nickname.lower()] + team.aliases:
+                index.setdefault(key, team)
+        team_index = index
+        return team_index
+
+
+# after a miss: reload the list from the API, unless that already happened this run. returns whether it did
+def refresh_teams(offline=False):
+    with team_index_lock:
+        if offline or team_cache_fresh:
+            return False
+        load_teams(refresh=True)
+        return True
+
+
+def lookup_team(key, offline):
+    team_index = load_teams(offline)
+    return team_index.get(key) or team_index.get(key.lower())
+
+
+# by id, or by full name, nickname or alias (case insensitive). None if there's no such team
+def get_team(key, offline=False):
+    team = lookup_team(key, offline)
+    if team is None and refresh_teams(offline):
+        team = lookup_team(key, offline)
+    return team
+
+
+def search_team(name, offline):
+    team = lookup_team(name, offline)
+    if team is not None:
+        return team
+    name = name.lower()
+    for team in teams_in_order:
+        if name in team.full_name.lower():
+            return team
+    return None
+
+
+# same idea as Team.load_by_name, without the API call: an exact name first, then any full name containing it
+def find_team(name, offline=False):
+    team = search_team(name, offline)
+    if team is None and refresh_teams(offline):
+        team = search_team(name, offline)
+    return team
+
+
+def get_nav(team_id):
+    team = get_team(team_id)
+    return team.nav if team is not None else None